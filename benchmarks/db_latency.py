@@ -0,0 +1,67 @@
+"""
+Задержка обработки апдейтов, пока рассылка пишет в базу.
+
+Запуск из корня репозитория: python -m benchmarks.db_latency [writes]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from bot_constructor.db_utils import DBUtils
+from bot_constructor.metrics import MetricsRegistry
+
+
+async def probe(stop: asyncio.Event, interval: float = 0.001) -> list[float]:
+    delays = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        delays.append(time.perf_counter() - started - interval)
+    return delays
+
+
+async def writer(db: DBUtils, writes: int, mode: str) -> None:
+    for i in range(writes):
+        query, args = 'UPDATE users SET is_active = ? WHERE user_id = ?', (0, str(i))
+        if mode == 'blocking':
+            db.storage.run_query(query, args)
+            await asyncio.sleep(0)
+        elif mode == 'executor':
+            await db.execute_query(query, *args)
+        else:
+            await db.update_activity(i)
+            await asyncio.sleep(0)
+    await db.buffer.flush()
+
+
+async def measure(db: DBUtils, writes: int, mode: str) -> dict[str, float]:
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(stop))
+    started = time.perf_counter()
+    await writer(db, writes, mode)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    delays = sorted(await probe_task) or [0.0]
+    return {'writes/s': writes / elapsed, 'p50, ms': statistics.median(delays) * 1000,
+            'p99, ms': delays[int(len(delays) * 0.99) - 1] * 1000, 'max, ms': delays[-1] * 1000}
+
+
+async def main(writes: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        Path('data').mkdir()
+        db = DBUtils(SimpleNamespace(jsons={}, admin_chat_id=None, metrics=MetricsRegistry()))
+        await db.execute_many('INSERT INTO users (user_id) VALUES (?)', [(str(i),) for i in range(writes)])
+        for mode in ['blocking', 'executor', 'buffered']:
+            result = await measure(db, writes, mode)
+            print(f'{mode:<10}', '  '.join(f'{key}: {value:.2f}' for key, value in result.items()))
+        await db.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000))
@@ -0,0 +1,99 @@
+"""
+Локальная замена Telegram Bot API для офлайн бенчмарков.
+"""
+import asyncio
+import random
+import time
+from collections import Counter, deque
+
+from aiohttp import web
+
+MESSAGE_METHODS = {'sendMessage', 'sendPhoto', 'editMessageText', 'editMessageMedia', 'editMessageCaption'}
+
+
+class FakeTelegramAPI:
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, retry_rate: float = 0.0, retry_after: int = 1,
+                 seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_rate = retry_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.requests: Counter[str] = Counter()
+        self.errors: Counter[int] = Counter()
+        self.message_id = 0
+        self.updates: deque[dict] = deque()
+        self.has_updates: asyncio.Event | None = None
+        self.runner: web.AppRunner | None = None
+
+    def get_message(self, method: str, data) -> dict:
+        self.message_id += 1
+        message_id = int(data['message_id']) if method.startswith('edit') and 'message_id' in data else self.message_id
+        message = {'message_id': message_id, 'date': int(time.time()),
+                   'chat': {'id': int(data.get('chat_id', 0)), 'type': 'private'}}
+        if method == 'sendPhoto' or method == 'editMessageMedia':
+            message['photo'] = [{'file_id': f'photo_{self.message_id}', 'file_unique_id': f'u{self.message_id}',
+                                 'width': 1, 'height': 1}]
+        else:
+            message['text'] = data.get('text') or data.get('caption') or ''
+        return message
+
+    def push_updates(self, updates: list[dict]) -> None:
+        self.updates.extend(updates)
+        if self.has_updates:
+            self.has_updates.set()
+
+    async def get_updates(self, data) -> list[dict]:
+        offset, limit = int(data.get('offset', 0)), int(data.get('limit', 100))
+        while self.updates and self.updates[0]['update_id'] < offset:
+            self.updates.popleft()
+        if not self.updates:
+            self.has_updates = self.has_updates or asyncio.Event()
+            self.has_updates.clear()
+            try:
+                await asyncio.wait_for(self.has_updates.wait(), float(data.get('timeout', 0)))
+            except asyncio.TimeoutError:
+                pass
+        return [self.updates[i] for i in range(min(limit, len(self.updates)))]
+
+    def get_error(self) -> tuple[int, dict] | None:
+        roll = self.random.random()
+        if roll < self.retry_rate:
+            return 429, {'description': f'Too Many Requests: retry after {self.retry_after}',
+                         'parameters': {'retry_after': self.retry_after}}
+        if roll < self.retry_rate + self.error_rate:
+            return 403, {'description': 'Forbidden: bot was blocked by the user'}
+        return None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.requests[method] += 1
+        data = await request.post()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        error = self.get_error() if method in MESSAGE_METHODS else None
+        if error:
+            status, payload = error
+            self.errors[status] += 1
+            return web.json_response({'ok': False, 'error_code': status, **payload}, status=status)
+        if method == 'getUpdates':
+            result = await self.get_updates(data)
+        elif method == 'getMe':
+            result = {'id': 123456, 'is_bot': True, 'first_name': 'benchmark', 'username': 'benchmark_bot'}
+        else:
+            result = self.get_message(method, data) if method in MESSAGE_METHODS else True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        app = web.Application(client_max_size=20 * 1024 ** 2)
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        host, port = self.runner.addresses[0][:2]
+        return f'http://{host}:{port}'
+
+    async def stop(self) -> None:
+        if self.runner:
+            await self.runner.cleanup()
@@ -0,0 +1,158 @@
+"""
+Офлайн бенчмарк BotConfig, Stats и Broadcast против локальной замены Bot API.
+
+Сценарии: поток /start от разных пользователей, глубокая навигация по callback-кнопкам и рассылка.
+Запуск из корня репозитория: python -m benchmarks.harness --help
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Update, User
+
+from benchmarks.fake_api import FakeTelegramAPI
+from benchmarks.startup import create_data
+from bot_constructor.bot_config import BotConfig
+
+ADMIN_CHAT_ID = 1
+WRITE_OPERATIONS = ('insert', 'update', 'delete', 'run_many', 'write_users', 'add_stats', 'set_stat', 'create_job', 'save_job')
+
+
+def get_user(user_id: int) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': 'user'}
+
+
+def get_message(update_id: int, user_id: int, text: str) -> dict:
+    return {'message_id': update_id, 'date': int(time.time()), 'chat': {'id': user_id, 'type': 'private'},
+            'from': get_user(user_id), 'text': text}
+
+
+def start_updates(count: int, first_id: int) -> list[Update]:
+    return [Update.model_validate({'update_id': first_id + i, 'message': get_message(first_id + i, 10_000 + i, '/start')})
+            for i in range(count)]
+
+
+def navigation_updates(config: BotConfig, count: int, first_id: int, seed: int = 0) -> list[Update]:
+    rand, updates, section = random.Random(seed), [], 'start'
+    for i in range(count):
+        children = [child for child in config.navigation.children.get(section, []) if child in config.messages]
+        section = rand.choice(children) if children else 'start'
+        user_id = 10_000 + i % 1000
+        updates.append(Update.model_validate({'update_id': first_id + i, 'callback_query': {
+            'id': str(first_id + i), 'from': get_user(user_id), 'chat_instance': 'benchmark', 'data': section,
+            'message': get_message(first_id + i, user_id, 'menu')}}))
+    return updates
+
+
+def get_db_writes(config: BotConfig) -> int:
+    series = config.metrics.histograms.get('bot_db_seconds', {})
+    return sum(histogram.count for labels, histogram in series.items() if dict(labels)['operation'] in WRITE_OPERATIONS)
+
+
+def percentile(values: list[float], share: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))] if values else 0.0
+
+
+async def replay(dp: Dispatcher, bot: Bot, updates: list[Update], concurrency: int) -> tuple[list[float], float, int]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def feed(update: Update) -> None:
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await dp.feed_update(bot, update)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(feed(update) for update in updates))
+    return latencies, time.perf_counter() - started, errors
+
+
+def report(name: str, count: int, elapsed: float, latencies: list[float], api_calls: int, db_writes: int,
+           errors: int = 0) -> None:
+    line = f'{name:<12} {count:>7}  {count / elapsed:>9.1f}/s'
+    if latencies:
+        line += f'  p50 {statistics.median(latencies) * 1000:>7.2f} ms  p99 {percentile(latencies, 0.99) * 1000:>7.2f} ms'
+    print(f'{line}  API: {api_calls}  записей в БД: {db_writes}  ошибок: {errors}')
+
+
+async def run(args: argparse.Namespace) -> None:
+    api = FakeTelegramAPI(args.latency, args.error_rate, args.retry_rate, args.retry_after, args.seed)
+    base = await api.start()
+    data_folder = Path.cwd() / 'data'
+    create_data(data_folder, args.nodes)
+    storage = None
+    if args.redis:
+        from bot_constructor.redis_storage import RedisStorage
+        storage = RedisStorage(args.redis, prefix=f'benchmark_{os.getpid()}')
+    config = BotConfig(data_folder=data_folder, admin_chat_id=ADMIN_CHAT_ID, broadcast_rate=args.broadcast_rate,
+                       broadcast_processes=args.processes, storage=storage, user_rate=args.user_rate)
+    bot = Bot('123456:BENCHMARK', session=AiohttpSession(api=TelegramAPIServer.from_base(base)))
+    dp = Dispatcher()
+    config.include_routers(dp)
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+
+    scenarios = [('/start', start_updates(args.starts, 1)),
+                 ('navigation', navigation_updates(config, args.callbacks, args.starts + 1, args.seed))]
+    for name, updates in scenarios:
+        calls, writes = api.requests.total(), get_db_writes(config)
+        latencies, elapsed, errors = await replay(dp, bot, updates, args.concurrency)
+        await config.db.buffer.flush()
+        report(name, len(updates), elapsed, latencies, api.requests.total() - calls, get_db_writes(config) - writes,
+               errors)
+
+    await config.db.storage.write_users({str(1_000_000 + i): (1, True) for i in range(args.users)})
+    broadcast = config.db.broadcast
+    broadcast.limiter.burst = max(1.0, args.broadcast_rate / 10)
+    audience = await config.db.count_by_activity()
+    calls, writes = api.requests.total(), get_db_writes(config)
+    started = time.perf_counter()
+    await broadcast.send_broadcast(bot, User(id=ADMIN_CHAT_ID, is_bot=False, first_name='admin', username='admin'),
+                                   {'chat_id': ADMIN_CHAT_ID, 'message_id': 1, **config.default_args},
+                                   {'text': 'Бенчмарк', 'media': None})
+    elapsed = time.perf_counter() - started
+    report('broadcast', audience, elapsed, [], api.requests.total() - calls, get_db_writes(config) - writes)
+    print(f'Ответы API: {dict(api.requests)}  ошибки: {dict(api.errors)}')
+
+    await dp.emit_shutdown(bot=bot, dispatcher=dp)
+    await bot.session.close()
+    await api.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, default=1000, help='Разделов в синтетическом меню')
+    parser.add_argument('--starts', type=int, default=5000, help='Апдейтов /start')
+    parser.add_argument('--callbacks', type=int, default=5000, help='Нажатий кнопок при навигации')
+    parser.add_argument('--users', type=int, default=100_000, help='Получателей рассылки')
+    parser.add_argument('--concurrency', type=int, default=100, help='Одновременно обрабатываемых апдейтов')
+    parser.add_argument('--broadcast-rate', type=float, default=10_000, help='Лимит рассылки, сообщений в секунду')
+    parser.add_argument('--user-rate', type=float, default=0, help='Лимит апдейтов в секунду на пользователя, 0 — выключен')
+    parser.add_argument('--processes', type=int, default=1, help='Процессов рассылки')
+    parser.add_argument('--redis', help='URL Redis для RedisStorage вместо SQLite, например redis://localhost:6379/15')
+    parser.add_argument('--latency', type=float, default=0.0, help='Задержка ответа API, в секундах')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов 403 (бот заблокирован)')
+    parser.add_argument('--retry-rate', type=float, default=0.0, help='Доля ответов 429 RetryAfter')
+    parser.add_argument('--retry-after', type=int, default=1, help='retry_after в ответах 429')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
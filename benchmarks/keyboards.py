@@ -0,0 +1,42 @@
+"""
+Производные клавиатуры BotConfig.edit_keyboard: deepcopy шаблона против сборки без deepcopy и LRU кэша.
+
+Запуск из корня репозитория: python -m benchmarks.keyboards [calls] [keys]
+"""
+import sys
+import time
+from copy import deepcopy
+
+from aiogram.types import InlineKeyboardMarkup
+
+from bot_constructor.keyboard_cache import KeyboardCache
+from bot_constructor.utils_funcs import generate_kb
+
+
+def legacy_edit_keyboard(template: InlineKeyboardMarkup, key: str, key_first: bool = False) -> InlineKeyboardMarkup:
+    kb = deepcopy(template.inline_keyboard)
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [btn.model_copy(update={'callback_data': f'{key}_{btn.callback_data}' if key_first
+                                else f'{btn.callback_data}_{key}'}) for btn in row] for row in kb])
+
+
+def measure(func, calls: int, keys: int) -> float:
+    started = time.perf_counter()
+    for i in range(calls):
+        func(f'item{i % keys}')
+    return (time.perf_counter() - started) / calls
+
+
+def main(calls: int, keys: int) -> None:
+    template = generate_kb('start', {f'action{i}': f'Действие {i}' for i in range(8)})
+    cache = KeyboardCache()
+    results = {'deepcopy': measure(lambda key: legacy_edit_keyboard(template, key), calls, keys),
+               'без deepcopy': measure(lambda key: KeyboardCache.build(template, key), calls, keys),
+               'LRU кэш': measure(lambda key: cache.get(template, 'template', key), calls, keys)}
+    for name, seconds in results.items():
+        print(f'{name:<14} {seconds * 1_000_000:>8.2f} мкс/вызов')
+    print(f'Попаданий: {cache.hits}  промахов: {cache.misses}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20_000, int(sys.argv[2]) if len(sys.argv) > 2 else 100)
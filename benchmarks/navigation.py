@@ -0,0 +1,62 @@
+"""
+Построение индекса навигации на синтетическом меню против старого рекурсивного поиска.
+
+Запуск из корня репозитория: python -m benchmarks.navigation [nodes]
+"""
+import sys
+import time
+
+from bot_constructor.navigation import Navigation
+
+
+def generate_menu(nodes: int, branching: int = 10) -> dict[str, dict]:
+    keyboards = {}
+    for parent in range((nodes - 1) // branching + 1):
+        children = {f'n{child}': f'Раздел {child}'
+                    for child in range(parent * branching + 1, min((parent + 1) * branching + 1, nodes))}
+        if parent % 5 == 0 and len(children) > 2:
+            first, second, *rest = children.items()
+            children = {'row': dict([first, second]), **dict(rest)}
+        if children:
+            keyboards[f'n{parent}'] = children
+    return keyboards
+
+
+def find_needle(key: str, kb: dict, needle: str) -> str | None:
+    for callback, text in kb.items():
+        if callback == needle and key != needle:
+            return key
+        elif isinstance(text, dict):
+            result = find_needle(key, text, needle)
+            if result:
+                return result
+    return None
+
+
+def legacy_parents(keyboards: dict[str, dict], nodes: int) -> dict[str, str]:
+    parents = {}
+    for needle in (f'n{node}' for node in range(nodes)):
+        for key, value in keyboards.items():
+            result = find_needle(key, value, needle)
+            if result:
+                parents[needle] = result
+                break
+    return parents
+
+
+def measure(func, *args) -> float:
+    started = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - started
+
+
+def main(nodes: int) -> None:
+    for size in sorted({1000, 2000, nodes}):
+        keyboards = generate_menu(size)
+        index_time = measure(Navigation, keyboards)
+        legacy_time = measure(legacy_parents, keyboards, size)
+        print(f'{size:>6} узлов  индекс: {index_time * 1000:.1f} ms  рекурсивный поиск: {legacy_time * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
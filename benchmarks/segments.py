@@ -0,0 +1,64 @@
+"""
+Сегменты аудитории рассылки: подсчет и выгрузка получателей по индексам против полного прохода по таблице.
+
+Запуск из корня репозитория: python -m benchmarks.segments [users] [rate]
+"""
+import asyncio
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bot_constructor.storage import SQLiteStorage
+
+SEGMENTS = [None, 'seen:30', 'new:7', 'section:catalog', 'section:about']
+SECTIONS = ['catalog', 'about', 'contacts', 'prices', None]
+
+
+async def fill(storage: SQLiteStorage, users: int) -> None:
+    rnd, now = random.Random(0), int(time.time())
+    await storage.write_users({str(1_000_000 + i): (int(rnd.random() > 0.1), True) for i in range(users)})
+    await storage.execute_many('UPDATE users SET first_seen = ?, last_seen = ?, section = ? WHERE user_id = ?',
+                               [(now - (first := rnd.randint(0, 365)) * 86400, now - rnd.randint(0, first) * 86400,
+                                 rnd.choice(SECTIONS), str(1_000_000 + i)) for i in range(users)])
+    await storage.execute_query('ANALYZE')
+
+
+async def scan(storage: SQLiteStorage, segment: str | None) -> tuple[int, float, float]:
+    started = time.perf_counter()
+    await storage.count_users(segment=segment)
+    counted = time.perf_counter()
+    total, after = 0, ''
+    while True:
+        users = await storage.get_users(after, 1000, segment)
+        total += len(users)
+        if len(users) < 1000:
+            break
+        after = users[-1]
+    return total, counted - started, time.perf_counter() - counted
+
+
+async def scan_table(storage: SQLiteStorage, segment: str | None) -> float:
+    condition, args = storage.get_segment_filter(segment)
+    started = time.perf_counter()
+    await storage.execute_query(f'SELECT COUNT(*) FROM users NOT INDEXED WHERE is_active = 1{condition}', *args)
+    return time.perf_counter() - started
+
+
+async def main(users: int, rate: float) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = SQLiteStorage(str(Path(tmp) / 'bot.db'))
+        storage.start()
+        await fill(storage, users)
+        for segment in SEGMENTS:
+            total, count, stream = await scan(storage, segment)
+            print(f'{segment or "all":<16} получателей: {total:>8}  count: {count * 1000:7.2f} ms  '
+                  f'count без индекса: {await scan_table(storage, segment) * 1000:7.2f} ms  '
+                  f'выгрузка: {stream * 1000:7.1f} ms  рассылка при {rate:g}/s: {total / rate / 60:6.1f} мин')
+        await storage.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000,
+                     float(sys.argv[2]) if len(sys.argv) > 2 else 25))
@@ -0,0 +1,58 @@
+"""
+Время запуска BotConfig из JSON файлов и из скомпилированного снимка.
+
+Запуск из корня репозитория: python -m benchmarks.startup [nodes]
+"""
+import asyncio
+import base64
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import orjson
+
+from benchmarks.navigation import generate_menu
+from bot_constructor.bot_config import BotConfig
+
+PIXEL = base64.b64decode('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAADElEQVR4nGP4z8AAAAMBAQDJ/pLvAAAAAElFTkSuQmCC')
+
+def create_data(data_folder: Path, nodes: int) -> None:
+    json_dir = data_folder / 'json'
+    json_dir.mkdir(parents=True)
+    (data_folder / 'images').mkdir()
+    (data_folder / 'images' / 'start.png').write_bytes(PIXEL)
+    keyboards = generate_menu(nodes)
+    keyboards['n0']['https://example.com'] = 'Сайт'
+    messages = {f'n{node}': f'Раздел <b>{node}</b>' for node in range(nodes)}
+    messages.update({'start': 'Привет', 'broadcast': 'Рассылка на {} пользователей',
+                     'broadcast_end': 'Рассылка «{}» доставлена {} пользователям ({} @{})'})
+    keyboards['start'] = keyboards.pop('n0')
+    (json_dir / 'keyboards.json').write_bytes(orjson.dumps({'keyboards': keyboards}))
+    (json_dir / 'messages.json').write_bytes(orjson.dumps({'messages': messages}))
+    (json_dir / 'stats.json').write_bytes(orjson.dumps({'stats': list(keyboards['start'])}))
+
+
+def measure(data_folder: Path, use_snapshot: bool) -> tuple[float, BotConfig]:
+    started = time.perf_counter()
+    config = BotConfig(data_folder=data_folder, use_snapshot=use_snapshot)
+    elapsed = time.perf_counter() - started
+    asyncio.run(config.db.close())
+    return elapsed, config
+
+
+def main(nodes: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        data_folder = Path(tmp) / 'data'
+        create_data(data_folder, nodes)
+        json_time, config = measure(data_folder, False)
+        config.save_snapshot()
+        snapshot_time, config = measure(data_folder, True)
+        print(f'{nodes} разделов  JSON: {json_time * 1000:.1f} ms  снимок: {snapshot_time * 1000:.1f} ms  '
+              f'({config.snapshot_path.stat().st_size / 1024:.0f} KB)')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,140 @@
+"""
+RedisStorage против SQLiteStorage: одинаковые операции с пользователями, сегментами, статистикой, рассылками,
+блокировками и FSM должны давать одинаковый результат. Без --redis Redis заменяется fakeredis
+(pip install fakeredis lupa, lupa нужна для Lua-скриптов блокировок).
+
+Запуск из корня репозитория: python -m benchmarks.storage_parity [--redis URL]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+from aiogram.fsm.storage.base import StorageKey
+
+from bot_constructor.redis_storage import RedisStorage
+from bot_constructor.storage import SQLiteStorage, Storage
+
+SEGMENTS = [None, 'seen:30', 'new:7', 'section:catalog', 'section:about']
+JOB_FIELDS = ['id', 'text', 'media', 'segment', 'sender', 'admin', 'status', 'cursor', 'done', 'sent', 'failed']
+
+
+async def check_users(storage: Storage, now: int) -> list[tuple[str, Any]]:
+    await storage.write_users({str(100 + i): (1, True) for i in range(30)})
+    await storage.write_users({}, None, {str(100 + i): (now - 40 * 86400, None) for i in range(30)})
+    await storage.write_users({}, None, {'101': (now, 'catalog'), '102': (now, 'about'), '103': (now, 'catalog'),
+                                         '999': (now, 'catalog')})
+    await storage.write_users({'102': (1, False)}, None, {'102': (now, 'catalog')})
+    await storage.write_users({}, {'103': ('blocked', now)})
+    await storage.write_users({'104': (0, False), '998': (1, False)})
+    await storage.write_users({'104': (1, False), '105': (0, False)})
+    await storage.write_users({'105': (1, True), '106': (0, False)}, {'107': ('blocked', now)})
+    await storage.write_users({'107': (1, False), '120': (1, True)}, None, {'120': (now, 'about')})
+    await storage.write_users({'121': (1, True)}, {'121': ('blocked', now)}, {'121': (now, 'about')})
+    results = []
+    for segment in SEGMENTS:
+        results += [(f'count_users active {segment}', await storage.count_users(True, '', segment)),
+                    (f'count_users active after 101 {segment}', await storage.count_users(True, '101', segment)),
+                    (f'count_users inactive {segment}', await storage.count_users(False, '', segment)),
+                    (f'get_users first page {segment}', await storage.get_users('', 2, segment)),
+                    (f'get_users after 101 {segment}', await storage.get_users('101', 1000, segment))]
+    return results
+
+
+async def check_stats(storage: Storage) -> list[tuple[str, Any]]:
+    await storage.add_stats({('2026-10', 'about'): 2}, [('2026-10', 'about'), ('2026-10', 'active_users')])
+    await storage.add_stats({('2026-10', 'about'): 3, ('2026-09', 'start'): 1})
+    await storage.set_stat('2026-10', 'active_users', 7)
+    await storage.set_stat('2026-08', 'inactive_users', 2)
+    return [('get_stats 2026-10', await storage.get_stats('2026-10')),
+            ('get_stats 2026-08', await storage.get_stats('2026-08')),
+            ('get_stats missing', await storage.get_stats('2020-01')),
+            ('get_periods', await storage.get_periods())]
+
+
+async def check_jobs(storage: Storage) -> list[tuple[str, Any]]:
+    def fields(row: dict | None) -> dict | None:
+        return {key: row.get(key) for key in JOB_FIELDS} if row else None
+
+    first = await storage.create_job({'text': 'hi', 'media': None, 'sender': '{}', 'admin': '{}'})
+    second = await storage.create_job({'text': 'x', 'media': 'file', 'segment': 'seen:7', 'sender': '{}',
+                                       'admin': '{}'})
+    await storage.save_job(first, {'cursor': '5', 'done': '["7"]', 'sent': 3, 'failed': 1})
+    await storage.save_job(second, {'status': 'paused'})
+    results = [('get_job', fields(await storage.get_job(first))),
+               ('get_jobs', [fields(row) for row in await storage.get_jobs()])]
+    await storage.save_job(first, {'status': 'done'})
+    return results + [('get_jobs after done', [row['id'] for row in await storage.get_jobs()]),
+                      ('get_job missing', await storage.get_job(999))]
+
+
+async def check_locks(storage: Storage) -> list[tuple[str, Any]]:
+    results = [('acquire free', await storage.acquire_lock('x', 'a', 5)),
+               ('acquire taken', await storage.acquire_lock('x', 'b', 5)),
+               ('renew own', await storage.acquire_lock('x', 'a', 5))]
+    await storage.release_lock('x', 'b')
+    results.append(('acquire after foreign release', await storage.acquire_lock('x', 'b', 5)))
+    await storage.release_lock('x', 'a')
+    results.append(('acquire after release', await storage.acquire_lock('x', 'b', 0.05)))
+    await asyncio.sleep(0.1)
+    results.append(('acquire after expiry', await storage.acquire_lock('x', 'a', 5)))
+    return results
+
+
+async def check_fsm(storage: Storage) -> list[tuple[str, Any]]:
+    fsm = storage.get_fsm_storage()
+    key = StorageKey(bot_id=1, chat_id=2, user_id=2)
+    await fsm.set_state(key, 'States:text')
+    await fsm.update_data(key, {'a': 1})
+    await fsm.update_data(key, {'b': [1, 2]})
+    results = [('fsm state', await fsm.get_state(key)), ('fsm data', await fsm.get_data(key))]
+    await fsm.set_state(key, None)
+    await fsm.set_data(key, {})
+    return results + [('fsm cleared', (await fsm.get_state(key), await fsm.get_data(key)))]
+
+
+async def run_checks(storage: Storage, now: int) -> list[tuple[str, Any]]:
+    results = []
+    for check in (check_users(storage, now), check_stats(storage), check_jobs(storage), check_locks(storage),
+                  check_fsm(storage)):
+        results += await check
+    await storage.close()
+    return results
+
+
+def create_redis(url: str | None) -> RedisStorage:
+    if url:
+        return RedisStorage(url, prefix=f'parity_{os.getpid()}')
+    from fakeredis import FakeAsyncRedis
+    return RedisStorage(FakeAsyncRedis(decode_responses=True), prefix='parity')
+
+
+async def run(args: argparse.Namespace) -> int:
+    now = int(time.time())
+    with tempfile.TemporaryDirectory() as tmp:
+        sqlite = SQLiteStorage(str(Path(tmp) / 'bot.db'))
+        sqlite.start()
+        expected = await run_checks(sqlite, now)
+    actual = await run_checks(create_redis(args.redis), now)
+    mismatches = 0
+    for (name, value), (_, redis_value) in zip(expected, actual):
+        if value != redis_value:
+            mismatches += 1
+            print(f'{name}: SQLite {value!r}, Redis {redis_value!r}')
+    print(f'Проверок: {len(expected)}, расхождений: {mismatches}')
+    return 1 if mismatches else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--redis', help='URL настоящего Redis, например redis://localhost:6379/15. '
+                                        'Ключи с префиксом parity_<pid> не удаляются')
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+WebhookServer против long polling на локальной замене Bot API: задержка от появления апдейта до конца его обработки
+и апдейтов в секунду. Апдейты /start и навигации записываются заранее и отправляются POST-запросами на вебхук
+или отдаются через getUpdates.
+
+Запуск из корня репозитория: python -m benchmarks.webhook --help
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import ClientSession, TCPConnector
+
+from benchmarks.fake_api import FakeTelegramAPI
+from benchmarks.harness import ADMIN_CHAT_ID, navigation_updates, percentile, start_updates
+from benchmarks.startup import create_data
+from bot_constructor.bot_config import BotConfig
+from bot_constructor.webhook import WebhookServer
+
+
+class Recorder:
+    def __init__(self, expected: int):
+        self.expected = expected
+        self.sent: dict[int, float] = {}
+        self.latencies: list[float] = []
+        self.done = asyncio.Event()
+
+    async def __call__(self, handler: Callable, event: Any, data: dict[str, Any]) -> Any:
+        try:
+            return await handler(event, data)
+        finally:
+            self.latencies.append(time.perf_counter() - self.sent.pop(event.update_id))
+            if len(self.latencies) >= self.expected:
+                self.done.set()
+
+
+async def pace(updates: list[dict], rate: float, recorder: Recorder, send: Callable[[dict], Awaitable]) -> None:
+    started = time.perf_counter()
+
+    async def send_at(i: int, update: dict) -> None:
+        if rate:
+            await asyncio.sleep(max(0.0, started + i / rate - time.perf_counter()))
+        recorder.sent[update['update_id']] = time.perf_counter()
+        await send(update)
+
+    await asyncio.gather(*(send_at(i, update) for i, update in enumerate(updates)))
+
+
+def record_updates(config: BotConfig, args: argparse.Namespace, first_id: int) -> list[dict]:
+    updates = (start_updates(args.starts, first_id) +
+               navigation_updates(config, args.callbacks, first_id + args.starts, args.seed))
+    return [update.model_dump(mode='json', by_alias=True, exclude_none=True) for update in updates]
+
+
+async def run_webhook(config: BotConfig, bot: Bot, updates: list[dict], args: argparse.Namespace) -> Recorder:
+    dp = Dispatcher()
+    config.include_routers(dp)
+    recorder = Recorder(len(updates))
+    dp.update.outer_middleware(recorder)
+    server = WebhookServer(config, bot, dp, concurrency=args.concurrency)
+    url = await server.start('127.0.0.1', 0) + server.path
+    async with ClientSession(connector=TCPConnector(limit=args.connections)) as session:
+        async def send(update: dict) -> None:
+            async with session.post(url, json=update) as response:
+                response.raise_for_status()
+
+        await pace(updates, args.rate, recorder, send)
+        await recorder.done.wait()
+        async with session.get(url.replace(server.path, '/ready')) as response:
+            print('  /ready:', await response.json())
+    await server.stop()
+    return recorder
+
+
+async def run_polling(config: BotConfig, bot: Bot, api: FakeTelegramAPI, updates: list[dict],
+                      args: argparse.Namespace) -> Recorder:
+    dp = Dispatcher()
+    config.include_routers(dp)
+    recorder = Recorder(len(updates))
+    dp.update.outer_middleware(recorder)
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, polling_timeout=1,
+                                                   tasks_concurrency_limit=args.concurrency))
+
+    async def send(update: dict) -> None:
+        api.push_updates([update])
+
+    await asyncio.sleep(0.5)
+    await pace(updates, args.rate, recorder, send)
+    await recorder.done.wait()
+    await dp.stop_polling()
+    await polling
+    return recorder
+
+
+def report(name: str, recorder: Recorder, elapsed: float) -> None:
+    latencies = recorder.latencies
+    print(f'{name:<8} {len(latencies):>7}  {len(latencies) / elapsed:>9.1f}/s  '
+          f'p50 {statistics.median(latencies) * 1000:>7.2f} ms  p99 {percentile(latencies, 0.99) * 1000:>7.2f} ms  '
+          f'max {max(latencies) * 1000:>7.2f} ms')
+
+
+async def run(args: argparse.Namespace) -> None:
+    api = FakeTelegramAPI(args.latency, seed=args.seed)
+    base = await api.start()
+    data_folder = Path.cwd() / 'data'
+    create_data(data_folder, args.nodes)
+    for i, mode in enumerate(args.modes):
+        config = BotConfig(data_folder=data_folder, admin_chat_id=ADMIN_CHAT_ID)
+        bot = Bot('123456:BENCHMARK', session=AiohttpSession(api=TelegramAPIServer.from_base(base)))
+        updates = record_updates(config, args, 1 + i * (args.starts + args.callbacks))
+        started = time.perf_counter()
+        if mode == 'webhook':
+            recorder = await run_webhook(config, bot, updates, args)
+        else:
+            recorder = await run_polling(config, bot, api, updates, args)
+        report(mode, recorder, time.perf_counter() - started)
+    await api.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', nargs='+', choices=['webhook', 'polling'], default=['webhook', 'polling'])
+    parser.add_argument('--nodes', type=int, default=1000, help='Разделов в синтетическом меню')
+    parser.add_argument('--starts', type=int, default=2000, help='Апдейтов /start')
+    parser.add_argument('--callbacks', type=int, default=2000, help='Нажатий кнопок при навигации')
+    parser.add_argument('--rate', type=float, default=0, help='Апдейтов в секунду, 0 — все сразу')
+    parser.add_argument('--concurrency', type=int, default=50, help='Одновременно обрабатываемых апдейтов')
+    parser.add_argument('--connections', type=int, default=40, help='Соединений к вебхуку, как max_connections')
+    parser.add_argument('--latency', type=float, default=0.0, help='Задержка ответа API, в секундах')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
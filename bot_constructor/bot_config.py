@@ -1,19 +1,35 @@
-from typing import Callable
-from copy import deepcopy
+import asyncio
+from time import monotonic
+from typing import Any, Callable
+from copy import copy
 
 import orjson
-from aiogram import Router, Dispatcher, F
+from aiogram import Bot, Router, Dispatcher, F
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import CommandStart
-from aiogram.types import InputMediaPhoto, Message, CallbackQuery
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import InputMediaPhoto, Message, CallbackQuery, FSInputFile, ChatMemberUpdated
 from accessify import private
 
 from bot_constructor.db_utils import DBUtils
+from bot_constructor.dispatch import CallbackDispatcher
+from bot_constructor.file_cache import FileIdCache
+from bot_constructor.keyboard_cache import KeyboardCache
+from bot_constructor.metrics import MetricsRegistry, MetricsMiddleware, MetricsRequestMiddleware
+from bot_constructor.navigation import Navigation
+from bot_constructor.render_cache import RenderCache, RenderCacheMiddleware
+from bot_constructor.reloader import ContentWatcher
+from bot_constructor.snapshot import get_header, load_snapshot, save_snapshot
+from bot_constructor.storage import Storage
+from bot_constructor.throttling import ThrottlingMiddleware
+from bot_constructor.webhook import WebhookServer
 from bot_constructor.utils_funcs import *
 
 
 class BotConfig:
-    def __init__(self, data_folder: Path = None, default_answer: str = '', default_args: dict = None, back_exclusions: tuple = None, admin_chat_id: int | str = None) -> None:
+    content_fields = ('jsons', 'texts', 'keyboards', 'navigation', 'images', 'image_files', 'messages')
+
+    def __init__(self, data_folder: Path = None, default_answer: str = '', default_args: dict = None, back_exclusions: tuple = None, admin_chat_id: int | str = None, broadcast_rate: float = 25, broadcast_processes: int = 1, use_snapshot: bool = True, hot_reload: bool = False, metrics_port: int = None, storage: Storage = None, user_rate: float = 2) -> None:
         """
         Создает быструю конфигурацию бота из JSON файлов.
 
@@ -25,46 +41,152 @@ class BotConfig:
         :type default_args: dict, optional
         :param back_exclusions: Callback-данные сообщений, у которых не должно быть кнопки назад (проверяется через endswith). По умолчанию: start, broadcast, stat
         :type back_exclusions: tuple, optional
+        :param broadcast_rate: Максимальная скорость рассылки, сообщений в секунду. По умолчанию: 25
+        :type broadcast_rate: float, optional
+        :param broadcast_processes: Сколько процессов рассылают сообщения. Больше 1 — получатели делятся на шарды по хешу user_id, лимит broadcast_rate общий. Процессы запускаются через spawn и заново импортируют __main__, поэтому запуск бота в скрипте должен быть под if __name__ == '__main__', иначе каждый шард запустит еще одного бота. По умолчанию: 1
+        :type broadcast_processes: int, optional
+        :param use_snapshot: Загружать конфигурацию из снимка data/config.snapshot, если он соответствует JSON файлам. По умолчанию: True
+        :type use_snapshot: bool, optional
+        :param hot_reload: Следить за data/json и data/images и перезагружать изменения без перезапуска. По умолчанию: False
+        :type hot_reload: bool, optional
+        :param metrics_port: Порт локального эндпоинта /metrics в формате Prometheus. По умолчанию метрики только собираются
+        :type metrics_port: int, optional
+        :param storage: Хранилище пользователей, статистики, рассылок и FSM. По умолчанию: SQLite в data/bot.db. Для нескольких процессов бота: RedisStorage
+        :type storage: Storage, optional
+        :param user_rate: Сколько апдейтов в секунду обрабатывать от одного пользователя, остальные отбрасываются. 0 — без ограничения. По умолчанию: 2
+        :type user_rate: float, optional
         """
 
-        self.data_folder = data_folder or Path.cwd() / 'data'
         self.default_answer = default_answer
-        self.default_args = default_args or {'parse_mode': 'HTML'}
-        self.back_exclusions = back_exclusions or ('start', 'broadcast', 'stat')
         self.admin_chat_id = int(admin_chat_id) if admin_chat_id else None
-        self.jsons = self.keyboards = self.images = self.messages = None
-        self.load_all()
-        self.texts = self.jsons.get('messages')
-        self.db = DBUtils(self)
+        self.broadcast_rate = broadcast_rate
+        self.broadcast_processes = broadcast_processes
+        self.init_content(data_folder, default_args, back_exclusions, use_snapshot)
+        self.watcher = ContentWatcher(self) if hot_reload else None
+        self.metrics = MetricsRegistry()
+        self.renders = RenderCache()
+        self.derived_keyboards = KeyboardCache(metrics=self.metrics)
+        self.metrics_port = metrics_port
+        self.user_rate = user_rate
+        self.callbacks = CallbackDispatcher()
+        self.db = DBUtils(self, storage)
         self.router = self.set_router()
         self.stat_router = self.db.stat.router if self.db.stat else None
         self.broadcast_router = self.db.broadcast.router if self.db.broadcast else None
 
-    @staticmethod
-    def find_needle(key: str, kb: dict, needle: str) -> str | None:
-        for callback, text in kb.items():
-            if callback == needle and key != needle:
-                return key
-            elif isinstance(text, dict):
-                result = BotConfig.find_needle(key, text, needle)
-                if result:
-                    return result
-        return None
+    def init_content(self, data_folder: Path = None, default_args: dict = None, back_exclusions: tuple = None,
+                     use_snapshot: bool = True) -> None:
+        self.data_folder = data_folder or Path.cwd() / 'data'
+        self.default_args = default_args or {'parse_mode': 'HTML'}
+        self.back_exclusions = back_exclusions or ('start', 'broadcast', 'stat')
+        self.use_snapshot = use_snapshot
+        self.snapshot_path = self.data_folder / 'config.snapshot'
+        self.jsons = self.keyboards = self.images = self.messages = self.navigation = None
+        self.file_ids = FileIdCache(self.data_folder / 'file_ids.json')
+        self.image_files: dict[str, tuple[str, str]] = {}
+        self.version = 1
+        self.load_all()
+        self.texts = self.jsons.get('messages')
+
+    @classmethod
+    def build_snapshot(cls, data_folder: Path = None, default_args: dict = None, back_exclusions: tuple = None) -> Path:
+        """
+        Собирает снимок конфигурации из JSON файлов, не открывая базу данных.
+        default_args и back_exclusions должны совпадать с переданными в BotConfig, иначе бот не примет снимок.
+
+        :return: Путь к сохраненному снимку
+        """
+
+        config = cls.__new__(cls)
+        config.init_content(data_folder, default_args, back_exclusions, use_snapshot=False)
+        config.save_snapshot()
+        return config.snapshot_path
 
     @private
     def get_previous_section(self, needle: str) -> str | None:
-        for key, value in self.jsons['keyboards'].items():
-            result = self.find_needle(key, value, needle)
-            if result:
-                return result
-        return None
+        return self.navigation.get_parent(needle)
+
+    def get_section(self, key: str) -> str:
+        """
+        Возвращает раздел главного меню, в который входит экран key.
+        """
+
+        path = self.navigation.get_path(key)
+        if 'start' not in path[:-1]:
+            return key
+        return path[path.index('start') + 1]
+
+    def get_sections(self) -> dict[str, str]:
+        return {key: self.navigation.labels.get(key, key) for key in self.navigation.children.get('start', [])
+                if key in self.messages}
 
     @private
     def load_all(self):
-        self.load_jsons()
-        self.load_keyboards()
-        self.load_images()
-        self.load_messages()
+        snapshot = load_snapshot(self.snapshot_path, self.get_snapshot_header()) if self.use_snapshot else None
+        if snapshot:
+            self.__dict__.update(snapshot)
+            self.load_images()
+            self.attach_images()
+        else:
+            self.load_jsons()
+            self.load_keyboards()
+            self.load_images()
+            self.load_messages()
+
+    def build_reload(self, changed: set[Path] = None) -> tuple[dict[str, Any], dict[str, int]]:
+        staging = copy(self)
+        json_dir, src_dir = self.data_folder / 'json', self.get_images_dir()
+        json_changed = changed is None or any(json_dir in path.parents for path in changed)
+        rebuilt = {}
+        if json_changed:
+            staging.load_jsons()
+            staging.texts = staging.jsons.get('messages')
+            rebuilt['jsons'] = len(staging.jsons)
+            if staging.jsons.get('keyboards') != self.jsons.get('keyboards'):
+                staging.load_keyboards()
+                rebuilt['keyboards'] = len(staging.keyboards)
+        if changed is None:
+            staging.load_images()
+            rebuilt['images'] = len(staging.image_files)
+        else:
+            staging.images, staging.image_files = dict(self.images), dict(self.image_files)
+            images = [path for path in changed if src_dir in path.parents]
+            for file_path in images:
+                if file_path.exists():
+                    staging.add_image(staging.images, src_dir, file_path)
+                else:
+                    staging.remove_image(staging.images, file_path.stem)
+            if json_changed:
+                for file in staging.image_files:
+                    staging.set_image(staging.images, file, staging.images[file].media)
+            rebuilt['images'] = len(images)
+        staging.load_messages()
+        rebuilt['messages'] = len(staging.messages)
+        return {field: getattr(staging, field) for field in self.content_fields}, rebuilt
+
+    async def reload(self, changed: set[Path] = None) -> dict[str, Any]:
+        started = monotonic()
+        content, rebuilt = await asyncio.to_thread(self.build_reload, changed)
+        self.__dict__.update(content)
+        self.version += 1
+        if 'keyboards' in rebuilt:
+            self.derived_keyboards.clear()
+        for component in [self.db.stat, self.db.broadcast]:
+            if component:
+                component.load_content()
+        report = {'version': self.version, 'seconds': monotonic() - started, 'rebuilt': rebuilt}
+        print(f"Конфигурация v{self.version} перезагружена за {report['seconds']:.3f} с: "
+              + ', '.join(f'{key} — {count}' for key, count in rebuilt.items()))
+        return report
+
+    def get_snapshot_header(self) -> dict:
+        params = {'default_args': self.default_args, 'back_exclusions': self.back_exclusions}
+        return get_header(self.data_folder / 'json', params)
+
+    def save_snapshot(self) -> None:
+        data = {'jsons': self.jsons, 'keyboards': self.keyboards, 'navigation': self.navigation,
+                'messages': self.build_messages()}
+        save_snapshot(self.snapshot_path, self.get_snapshot_header(), data)
 
     @staticmethod
     def load_files(target_dir: Path, func: Callable) -> dict:
@@ -75,20 +197,49 @@ class BotConfig:
                 func(result, file_path)
         return result
 
+    def get_images_dir(self) -> Path:
+        return Path(find_resource_path(self.data_folder / 'images'))
+
     def load_images(self) -> None:
-        img_folder = self.data_folder / 'images'
-        src_dir = Path(find_resource_path(img_folder))
+        src_dir = self.get_images_dir()
 
         def append_file(result: dict, file_path: Path):
-            fsinput = create_input_file(file_path)
-            file = file_path.stem
-            caption = self.jsons['messages'].get(file)
-            result[file] = InputMediaPhoto(media=fsinput, caption=caption, parse_mode='HTML')
-            if file == 'start':
-                result['cmd_start'] = fsinput
+            self.add_image(result, src_dir, file_path)
 
+        self.image_files = {}
         self.images = self.load_files(src_dir, append_file)
 
+    def add_image(self, images: dict, src_dir: Path, file_path: Path) -> None:
+        file = file_path.stem
+        self.image_files[file] = (file_path.relative_to(src_dir).as_posix(), self.file_ids.get_hash(file_path))
+        media = self.file_ids.get(*self.image_files[file]) or create_input_file(file_path)
+        self.set_image(images, file, media)
+
+    def remove_image(self, images: dict, file: str) -> None:
+        self.image_files.pop(file, None)
+        images.pop(file, None)
+        if file == 'start':
+            images.pop('cmd_start', None)
+
+    def set_image(self, images: dict, file: str, media: FSInputFile | str) -> None:
+        caption = self.jsons['messages'].get(file)
+        images[file] = InputMediaPhoto(media=media, caption=caption, parse_mode='HTML')
+        if file == 'start':
+            images['cmd_start'] = media
+
+    def cache_file_id(self, file: str, response: Message | bool) -> None:
+        if file not in self.image_files or not isinstance(self.images[file].media, FSInputFile):
+            return
+        if not isinstance(response, Message) or not response.photo:
+            return
+        file_id = response.photo[-1].file_id
+        self.file_ids.set(*self.image_files[file], file_id)
+        self.set_image(self.images, file, file_id)
+        if file in self.messages and 'media' in self.messages[file]:
+            self.messages[file]['media'] = self.images[file]
+        if file == 'start' and 'photo' in self.messages['cmd_start']:
+            self.messages['cmd_start']['photo'] = file_id
+
     def load_jsons(self) -> None:
         json_dir = self.data_folder / 'json'
 
@@ -111,6 +262,9 @@ class BotConfig:
 
         
     def load_keyboards(self) -> None:
+        self.navigation = Navigation(self.jsons['keyboards'])
+        for cycle in self.navigation.find_cycles():
+            print(f"Цикл в навигации: {' → '.join(cycle)}")
         self.keyboards = {}
         for key, kb in self.jsons['keyboards'].items():
             if key.endswith(self.back_exclusions) or 'back' in kb or 'start' in kb or 'Назад' in key:
@@ -123,21 +277,28 @@ class BotConfig:
 
 
     def load_messages(self) -> None:
+        self.messages = self.build_messages()
+        self.attach_images()
+
+    def build_messages(self) -> dict[str, dict]:
         raw_messages = self.jsons['messages']
-        self.messages = {
+        messages = {
             'cmd_start': {
-                'photo':        self.images.get('cmd_start'), 'caption': raw_messages.get('start'),
+                'photo':        None, 'caption': raw_messages.get('start'),
                 'reply_markup': self.keyboards.get('start'), **self.default_args
             }
         }
         for callback in raw_messages.keys():
-            args = {**self.default_args,
-                    'reply_markup': self.keyboards.get(callback) or generate_kb(self.get_previous_section(callback))}
-            if self.images.get(callback):
+            messages[callback] = {**self.default_args, 'text': raw_messages.get(callback),
+                                  'reply_markup': self.keyboards.get(callback) or generate_kb(self.get_previous_section(callback))}
+        return messages
+
+    def attach_images(self) -> None:
+        self.messages['cmd_start']['photo'] = self.images.get('cmd_start')
+        for callback, args in self.messages.items():
+            if callback != 'cmd_start' and self.images.get(callback):
+                args.pop('text', None)
                 args['media'] = self.images.get(callback)
-            else:
-                args['text'] = raw_messages.get(callback)
-            self.messages[callback] = args
 
     def set_router(self) -> Router:
         router = Router()
@@ -147,7 +308,8 @@ class BotConfig:
             # await message.answer(str(message.chat.id))
             start_message = self.messages.get('cmd_start')
             if 'photo' in start_message:
-                await message.answer_photo(**start_message)
+                response = await message.answer_photo(**start_message)
+                self.cache_file_id('start', response)
             else:
                 await message.answer(**start_message)
             await self.db.add_user(message.from_user.id)
@@ -159,23 +321,110 @@ class BotConfig:
                 await message.answer(self.default_answer)
 
         @router.callback_query()
-        async def handle_callback(callback: CallbackQuery):
-            await self.handle_message(callback)
+        async def handle_callback(callback: CallbackQuery, **data):
+            await self.callbacks.dispatch(callback, self.handle_message, data)
+
+        @router.my_chat_member(F.chat.type == 'private')
+        async def handle_chat_member(update: ChatMemberUpdated):
+            if update.new_chat_member.status == 'kicked':
+                await self.db.mark_failed(update.chat.id, 'blocked')
+            elif update.new_chat_member.status == 'member':
+                await self.db.update_activity(update.chat.id, True)
 
         return router
 
+    def get_args(self, key: str, additional: dict = None) -> dict:
+        args = self.messages.get(key) or self.default_args
+        return {**args, **additional} if additional else args
+
     async def handle_message(self, callback: CallbackQuery, additional: dict = None) -> any:
-        args = self.messages.get(callback.data) or self.default_args
-        if additional:
-            args = {**args, **additional}
+        await self.db.add_visit(callback.from_user.id, self.get_section(callback.data))
+        args = self.get_args(callback.data, additional)
+        fingerprint = self.check_render(callback, args)
+        if fingerprint is None:
+            return await callback.answer()
 
-        if args.get('media'):
-            return await callback.message.edit_media(**args)
-        return await self.handle_edit_message(callback.message, args)
+        try:
+            if args.get('media'):
+                response = await callback.message.edit_media(**args)
+                if isinstance(args['media'].media, FSInputFile):
+                    self.cache_file_id(callback.data, response)
+                    fingerprint = self.renders.get_fingerprint(self.get_args(callback.data, additional))
+            else:
+                response = await self.handle_edit_message(callback.message, args)
+        except TelegramBadRequest as e:
+            if 'message is not modified' not in e.message:
+                raise
+            self.remember_render(callback.message, fingerprint)
+            return await callback.answer()
+        self.remember_render(response if isinstance(response, Message) else callback.message, fingerprint)
+        return response
+
+    def check_render(self, callback: CallbackQuery, args: dict) -> int | None:
+        """
+        Сравнивает новый экран с уже показанным в сообщении.
+
+        :return: Отпечаток нового экрана или None, если сообщение уже содержит этот экран
+        """
+
+        fingerprint = self.renders.get_fingerprint(args)
+        message = callback.message
+        if message and self.renders.is_current((message.chat.id, message.message_id), fingerprint,
+                                               getattr(message, 'edit_date', None)):
+            self.renders.saved += 1
+            self.metrics.inc('bot_edits_skipped_total')
+            return None
+        return fingerprint
+
+    def remember_render(self, message: Message, fingerprint: int) -> None:
+        if message:
+            self.renders.set((message.chat.id, message.message_id), fingerprint, getattr(message, 'edit_date', None))
 
     def include_routers(self, dp: Dispatcher):
         routers = [router for router in [self.stat_router, self.broadcast_router] if router]
         dp.include_routers(*routers, self.router)
+        if isinstance(dp.fsm.storage, MemoryStorage):
+            dp.fsm.storage = self.db.storage.get_fsm_storage()
+        if self.user_rate:
+            throttling = ThrottlingMiddleware(self.metrics, self.user_rate,
+                                              exempt=(self.admin_chat_id,) if self.admin_chat_id else ())
+            dp.message.outer_middleware(throttling)
+            dp.callback_query.outer_middleware(throttling)
+        dp.message.middleware(MetricsMiddleware(self.metrics))
+        dp.callback_query.middleware(MetricsMiddleware(self.metrics, self.callbacks))
+        dp.startup.register(self.instrument_bot)
+        if self.metrics_port:
+            dp.startup.register(self.serve_metrics)
+            dp.shutdown.register(self.metrics.stop)
+        if self.db.broadcast:
+            dp.startup.register(self.db.broadcast.start)
+            dp.shutdown.register(self.db.broadcast.close)
+        if self.watcher:
+            dp.startup.register(self.watcher.start)
+            dp.shutdown.register(self.watcher.stop)
+        dp.shutdown.register(self.db.close)
+
+    async def instrument_bot(self, bot: Bot) -> None:
+        if not any(isinstance(middleware, MetricsRequestMiddleware) for middleware in bot.session.middleware):
+            bot.session.middleware(MetricsRequestMiddleware(self.metrics))
+        if not any(isinstance(middleware, RenderCacheMiddleware) for middleware in bot.session.middleware):
+            bot.session.middleware(RenderCacheMiddleware(self.renders))
+
+    async def serve_metrics(self) -> None:
+        await self.metrics.serve(port=self.metrics_port)
+
+    async def run_webhook(self, bot: Bot, host: str = '0.0.0.0', port: int = 8080, url: str = None,
+                          **kwargs: Any) -> None:
+        """
+        Запускает бота на вебхуке вместо long polling и работает до SIGINT/SIGTERM.
+        Остановка дожидается обработки принятых апдейтов и сбрасывает записи в базу.
+
+        :param url: Публичный адрес вебхука для setWebhook
+        :type url: str, optional
+        :param kwargs: Параметры WebhookServer: path, secret_token, concurrency, queue_size, drain_timeout
+        """
+
+        await WebhookServer(self, bot, **kwargs).run(host, port, url)
 
     @staticmethod
     async def handle_edit_message(message: Message, args: dict):
@@ -189,10 +438,5 @@ class BotConfig:
                 pass
         return response
 
-    def edit_keyboard(self, key: str, template_kb: str, key_first: bool = False):
-        kb = deepcopy(self.keyboards.get(template_kb).inline_keyboard)
-        for i in range(len(kb)):
-            for j in range(len(kb[i])):
-                btn_data = kb[i][j].callback_data
-                kb[i][j].callback_data = f'{key}_{btn_data}' if key_first else f'{btn_data}_{key}'
-        return InlineKeyboardMarkup(inline_keyboard=kb)
+    def edit_keyboard(self, key: str, template_kb: str, key_first: bool = False) -> InlineKeyboardMarkup:
+        return self.derived_keyboards.get(self.keyboards.get(template_kb), template_kb, key, key_first)
@@ -1,12 +1,23 @@
 import asyncio
-from typing import Any, Callable, Union
+from datetime import timedelta
+from time import monotonic
+from typing import Any, Union
+from uuid import uuid4
 
+import orjson
 from aiogram import Router, Bot, F
-from aiogram.exceptions import TelegramRetryAfter, TelegramAPIError, AiogramError, TelegramBadRequest
+from aiogram.exceptions import TelegramAPIError, AiogramError, TelegramBadRequest
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
-from aiogram.types import Message, InlineKeyboardMarkup, CallbackQuery, User, InputMediaPhoto
+from aiogram.types import Message, InlineKeyboardMarkup, CallbackQuery, User, InputMediaPhoto, InlineKeyboardButton
+
+from bot_constructor.delivery import BroadcastJob, Delivery
+from bot_constructor.rate_limiter import RateLimiter
+from bot_constructor.sharded_broadcast import ShardedDelivery
+from bot_constructor.storage import ACTIVE_JOBS
+from bot_constructor.utils_funcs import generate_kb
+
 
 class States(StatesGroup):
     message_id = State()
@@ -14,16 +25,38 @@ class States(StatesGroup):
     media = State()
 
 
-class Broadcast:
+class Broadcast(Delivery):
+    checkpoint_interval = 1.0
+    lock_ttl = 30.0
+    resume_interval = 30.0
+    progress_interval = 5.0
+    progress_template = ('{header}\n\n'
+                         'Отправлено: {sent}\n'
+                         'Ошибок: {failed}\n'
+                         'Осталось: {remaining}\n'
+                         'Скорость: {rate:.1f} сообщ./сек\n'
+                         'Примерное время: {eta}')
+    segments = {'': 'Все пользователи', 'seen:7': 'Заходили за 7 дней', 'seen:30': 'Заходили за 30 дней',
+                'new:7': 'Новые за 7 дней'}
+
     def __init__(self, db):
         self.db = db
         self.config = self.db.config
+        self.keyboards = self.messages = None
+        self.load_content()
+        self.base_args = self.config.default_args
+        self.limiter = RateLimiter(self.config.broadcast_rate)
+        self.jobs: dict[int, BroadcastJob] = {}
+        self.tasks: set[asyncio.Task] = set()
+        self.resumer: asyncio.Task | None = None
+        self.owner = uuid4().hex
+        self.router = self.set_router()
+
+    def load_content(self) -> None:
         kbs = self.config.keyboards
         self.keyboards = {kb: kbs.get(f'{kb}_broadcast') for kb in ['cancel', 'edit', 'confirm']}
         self.keyboards['receive'] = kbs.get('broadcast')
         self.messages = self.config.jsons['messages']
-        self.base_args = self.config.default_args
-        self.router = self.set_router()
 
     @staticmethod
     async def get_args(message: Message, state: FSMContext = None, kb: InlineKeyboardMarkup = None) -> dict[str, Any]:
@@ -40,7 +73,17 @@ class Broadcast:
 
     async def get_result(self, state: FSMContext) -> str:
         data = await state.get_data()
-        return self.messages.get('broadcast_result').format(data.get('text'), await self.get_active())
+        active = await self.get_active(data.get('segment'))
+        return self.messages.get('broadcast_result').format(data.get('text'), active)
+
+    def get_segments(self) -> dict[str, str]:
+        sections = {f'section:{key}': f'Раздел «{label}»' for key, label in self.config.get_sections().items()}
+        return {**self.segments, **sections}
+
+    def get_confirm_kb(self, segment: str = None) -> InlineKeyboardMarkup:
+        label = self.get_segments().get(segment or '', segment)
+        button = InlineKeyboardButton(text=f'🎯 {label}', callback_data='segment_broadcast')
+        return InlineKeyboardMarkup(inline_keyboard=[[button], *self.keyboards['confirm'].inline_keyboard])
 
     @staticmethod
     def get_media_args(data: dict, args: dict = None, text: str = None) -> dict[str, Any]:
@@ -49,24 +92,147 @@ class Broadcast:
         args[key] = text or data.get('text')
         return args
 
-    async def send_message(self, user_id: str, func: Callable, params: dict[str, str]) -> bool:
+    async def handle_failure(self, user_id: str, reason: str) -> None:
+        await self.db.mark_failed(user_id, reason)
+
+    async def create_job(self, params: dict, sender: User, admin_params: dict) -> BroadcastJob:
+        admin = orjson.dumps({key: admin_params[key] for key in ['chat_id', 'message_id']}).decode()
+        job_id = await self.db.storage.create_job({'text': params['text'], 'media': params['media'],
+                                                   'segment': params.get('segment'),
+                                                   'sender': sender.model_dump_json(), 'admin': admin})
+        job = BroadcastJob(job_id, params, sender, admin_params)
+        self.jobs[job_id] = job
+        await self.db.storage.acquire_lock(f'broadcast_{job_id}', self.owner, self.lock_ttl)
+        job.total = await self.db.count_by_activity(segment=params.get('segment'))
+        return job
+
+    async def save_job(self, job: BroadcastJob) -> None:
+        await self.db.storage.save_job(job.id, {'status': job.status, 'cursor': job.cursor,
+                                                'done': orjson.dumps(job.get_done()).decode(), 'sent': job.sent,
+                                                'failed': job.failed})
+        job.saved_status = job.status
+
+    async def sync_job(self, job: BroadcastJob) -> bool:
+        """
+        Применяет паузу, продолжение или отмену, нажатые в другом процессе бота.
+
+        :return: Изменился ли статус рассылки
+        """
+
+        row = await self.db.storage.get_job(job.id)
+        if not row or row['status'] == job.saved_status or row['status'] not in (*ACTIVE_JOBS, 'cancelled'):
+            return False
+        job.set_status(row['status'])
+        return True
+
+    def load_job(self, row: dict) -> BroadcastJob:
+        return BroadcastJob(row['id'], {'text': row['text'], 'media': row['media'], 'segment': row.get('segment')},
+                            User.model_validate_json(row['sender']), {**orjson.loads(row['admin']), **self.base_args},
+                            row['status'], row['cursor'], orjson.loads(row['done']), row['sent'], row['failed'])
+
+    async def load_jobs(self) -> list[BroadcastJob]:
+        return [self.load_job(row) for row in await self.db.storage.get_jobs()]
+
+    def run_job(self, bot: Bot, job: BroadcastJob) -> None:
+        self.jobs[job.id] = job
+        task = asyncio.create_task(self.send_broadcast(bot, job.sender, job.admin_params, job.params, job))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def resume_jobs(self, bot: Bot) -> None:
+        """
+        Продолжает незавершенные рассылки, которые никто не рассылает: их блокировка отпущена или истекла.
+        """
+
+        for row in await self.db.storage.get_jobs():
+            job_id = row['id']
+            if job_id in self.jobs or not await self.db.storage.acquire_lock(f'broadcast_{job_id}', self.owner,
+                                                                             self.lock_ttl):
+                continue
+            row = await self.db.storage.get_job(job_id)
+            if job_id in self.jobs:
+                continue
+            if not row or row['status'] not in ACTIVE_JOBS:
+                await self.db.storage.release_lock(f'broadcast_{job_id}', self.owner)
+                continue
+            self.run_job(bot, self.load_job(row))
+
+    async def watch_jobs(self, bot: Bot) -> None:
+        while True:
+            try:
+                await self.resume_jobs(bot)
+            except Exception as e:
+                print(f'Не удалось продолжить рассылки: {e}')
+            await asyncio.sleep(self.resume_interval)
+
+    async def start(self, bot: Bot) -> None:
+        self.resumer = asyncio.create_task(self.watch_jobs(bot))
+
+    async def close(self) -> None:
+        """
+        Останавливает рассылки этого процесса до закрытия хранилища: они сохраняют курсор и отпускают блокировку,
+        поэтому следующий запуск бота сразу их продолжит.
+        """
+
+        tasks = [*self.tasks, self.resumer] if self.resumer else list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.resumer = None
+
+    async def monitor(self, bot: Bot, job: BroadcastJob) -> None:
+        reported, text = monotonic(), None
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            job.tick()
+            if not await self.db.storage.acquire_lock(f'broadcast_{job.id}', self.owner, self.lock_ttl):
+                print(f'Рассылку {job.id} продолжил другой процесс бота, здесь она остановлена')
+                job.release()
+                return
+            if await self.sync_job(job):
+                await self.save_job(job)
+                await self.update_progress(bot, job)
+                continue
+            await self.save_job(job)
+            if monotonic() - reported < self.progress_interval or job.status != 'running':
+                continue
+            reported = monotonic()
+            new_text = self.get_job_text(job)
+            if new_text != text:
+                text = new_text
+                await self.update_progress(bot, job, text)
+
+    def get_job_text(self, job: BroadcastJob) -> str:
+        progress = job.get_progress()
+        eta = timedelta(seconds=round(progress['eta'])) if progress['eta'] is not None else '—'
+        header = '⏸ <b>Рассылка приостановлена</b>' if job.status == 'paused' else '⏳ <b>Рассылка в процессе…</b>'
+        template = self.messages.get('broadcast_progress') or self.progress_template
+        return template.format(header=header, **{**progress, 'eta': eta})
+
+    async def update_progress(self, bot: Bot, job: BroadcastJob, text: str = None) -> None:
+        message_args = self.get_media_args(job.params, {**job.admin_params, 'reply_markup': self.get_job_kb(job)},
+                                           text or self.get_job_text(job))
+        func = bot.edit_message_caption if job.params.get('media') else bot.edit_message_text
         try:
-            await func(chat_id=user_id, **params)
-        except TelegramRetryAfter as e:
-            await asyncio.sleep(e.retry_after)
-            return await self.send_message(user_id, func, params)
-        except (TelegramAPIError, AiogramError) as e:
-            print(f"Ошибка отправки пользователю {user_id}: {e}")
-            await self.db.update_activity(user_id)
-        else:
-            return True
-        return False
-
-    async def send_broadcast(self, bot: Bot, sender: User, admin_params: dict, broadcast_params: dict) -> None:
-        count = 0
+            await func(**message_args)
+        except (TelegramAPIError, AiogramError):
+            pass
+
+    @staticmethod
+    def get_job_kb(job: BroadcastJob) -> InlineKeyboardMarkup:
+        callback, text = ('pause', '⏸ Пауза') if job.status == 'running' else ('confirm', '▶️ Продолжить')
+        return generate_kb(data={f'{callback}_broadcast_{job.id}': text, f'cancel_broadcast_{job.id}': '❌ Отменить'})
+
+    async def send_broadcast(self, bot: Bot, sender: User, admin_params: dict, broadcast_params: dict,
+                             job: BroadcastJob = None) -> None:
+        job = job or await self.create_job(broadcast_params, sender, admin_params)
+        if not job.total:
+            job.total = job.processed + await self.db.count_by_activity(after=job.cursor,
+                                                                        segment=broadcast_params.get('segment'))
+        job.tick()
+        monitor = asyncio.create_task(self.monitor(bot, job))
         try:
-            semaphore = asyncio.Semaphore(20)
-            message_text, media = broadcast_params['text'], broadcast_params['media']
+            media = broadcast_params['media']
             args = self.get_media_args(broadcast_params)
             args['reply_markup'] = self.keyboards['receive']
             if media:
@@ -75,22 +241,30 @@ class Broadcast:
             else:
                 func = bot.send_message
 
-            async def send(user_id):
-                async with semaphore:
-                    return await self.send_message(user_id, func, args)
-
-            users = await self.db.get_active_users()
-            batch_size = 500
-            count = 0
-            for i in range(0, len(users), batch_size):
-                batch = users[i:i + batch_size]
-                results = await asyncio.gather(*(send(user_id) for user_id in batch))
-                count += sum(results)
+            users = self.db.iter_active_users(after=job.cursor, segment=broadcast_params.get('segment'))
+            if self.config.broadcast_processes > 1:
+                await ShardedDelivery(self, bot, self.config.broadcast_processes).deliver(users, func.__name__, args, job)
+            else:
+                await self.deliver(users, func, args, job)
+            if not job.cancelled:
+                job.status = 'done'
             await self.db.count_users()
+        except Exception as e:
+            job.fail(str(e))
+            raise
         finally:
-            text = self.messages.get('broadcast_end').format(broadcast_params['text'], count, sender.first_name,
-                                                             sender.username)
-            await self.handle_message_edit(bot, text, broadcast_params, admin_params)
+            monitor.cancel()
+            if job.status != 'released':
+                await self.save_job(job)
+                await self.db.storage.release_lock(f'broadcast_{job.id}', self.owner)
+            if job.status != 'running':
+                self.jobs.pop(job.id, None)
+            if job.status not in (*ACTIVE_JOBS, 'released'):
+                text = self.messages.get('broadcast_end').format(broadcast_params['text'], job.sent, sender.first_name,
+                                                                 sender.username)
+                if job.status == 'failed':
+                    text += f'\n\n❗ Рассылка остановлена из-за ошибки: {job.error}'
+                await self.handle_message_edit(bot, text, broadcast_params, admin_params)
 
     @staticmethod
     async def handle_message_edit(bot: Bot, text: str, args: dict, admin_args: dict = None) -> None:
@@ -104,8 +278,8 @@ class Broadcast:
                 admin_args.pop('message_id')
             await bot.send_message(text=text, **admin_args)
 
-    async def get_active(self) -> int:
-        return len(await self.db.get_active_users())
+    async def get_active(self, segment: str = None) -> int:
+        return await self.db.count_by_activity(segment=segment)
 
     def set_router(self):
         router = Router()
@@ -122,9 +296,9 @@ class Broadcast:
             await state.set_state(States.text)
 
         router.message.register(initiate_broadcast, Command('mail'), F.chat.id == self.config.admin_chat_id)
-        router.callback_query.register(initiate_broadcast, F.data == 'broadcast')
+        self.config.callbacks.add('broadcast', initiate_broadcast)
 
-        @router.callback_query(F.data == 'cancel_broadcast')
+        @self.config.callbacks.register('cancel_broadcast')
         async def cancel_broadcast(callback: CallbackQuery, state: FSMContext):
             await state.clear()
             await callback.message.delete()
@@ -135,8 +309,6 @@ class Broadcast:
             await state.update_data(text=message.text)
             await self.get_media(message, state, bot)
 
-        confirm_kb = self.keyboards['confirm']
-
         @router.message(States.media)
         async def get_broadcast_media(message: Message, state: FSMContext, bot: Bot):
             await message.delete()
@@ -145,20 +317,67 @@ class Broadcast:
             media = message.photo[0].file_id
             await state.update_data(media=media)
             input_media = InputMediaPhoto(media=media, caption=await self.get_result(state), **self.base_args)
-            await bot.edit_message_media(media=input_media, **await self.get_args(message, state, confirm_kb))
+            kb = self.get_confirm_kb((await state.get_data()).get('segment'))
+            await bot.edit_message_media(media=input_media, **await self.get_args(message, state, kb))
 
-        @router.callback_query(F.data == 'skip_pictures')
+        @self.config.callbacks.register('skip_pictures')
         async def skip_pictures(callback: CallbackQuery, state: FSMContext):
             await state.update_data(media=None)
-            await callback.message.edit_text(await self.get_result(state), reply_markup=confirm_kb, **self.base_args)
+            kb = self.get_confirm_kb((await state.get_data()).get('segment'))
+            await callback.message.edit_text(await self.get_result(state), reply_markup=kb, **self.base_args)
 
-        @router.callback_query(F.data == 'confirm_broadcast')
+        @self.config.callbacks.register('segment_broadcast')
+        async def choose_segment(callback: CallbackQuery, state: FSMContext):
+            segment = (await state.get_data()).get('segment') or ''
+            segments = self.get_segments()
+            keys = list(segments) if segment in segments else [*segments, segment]
+            await state.update_data(segments=keys)
+            data = {f'segment_broadcast_{i}': ('✅ ' if key == segment else '') + label
+                    for i, (key, label) in enumerate(segments.items())}
+            back = f'segment_broadcast_{keys.index(segment)}'
+            await callback.message.edit_reply_markup(reply_markup=generate_kb(back, data))
+
+        @self.config.callbacks.register('segment_broadcast_', prefix=True)
+        async def set_segment(callback: CallbackQuery, state: FSMContext, bot: Bot):
+            index = callback.data.removeprefix('segment_broadcast_')
+            data = await state.get_data()
+            keys = data.get('segments') or []
+            if not index.isdigit() or int(index) >= len(keys):
+                return await callback.answer()
+            segment = keys[int(index)]
+            if segment == (data.get('segment') or ''):
+                return await callback.message.edit_reply_markup(reply_markup=self.get_confirm_kb(segment))
+            await state.update_data(segment=segment or None)
+            admin_args = {**await self.get_args(callback.message), 'reply_markup': self.get_confirm_kb(segment),
+                          **self.base_args}
+            await self.handle_message_edit(bot, await self.get_result(state), data, admin_args)
+
+        @self.config.callbacks.register('confirm_broadcast')
         async def confirm_broadcast(callback: CallbackQuery, state: FSMContext, bot: Bot):
             data = await state.get_data()
             await state.clear()
             admin_params = {**await self.get_args(callback.message), **self.base_args}
-            await self.handle_message_edit(callback.message.bot, f'⏳ <b>Рассылка в процессе…</b>', data, admin_params)
-            params = {key: data[key] for key in ['text', 'media']}
-            await self.send_broadcast(bot, callback.from_user, admin_params, params)
+            params = {key: data.get(key) for key in ['text', 'media', 'segment']}
+            job = await self.create_job(params, callback.from_user, admin_params)
+            await self.handle_message_edit(callback.message.bot, self.get_job_text(job), data,
+                                           {**admin_params, 'reply_markup': self.get_job_kb(job)})
+            self.run_job(bot, job)
+
+        @self.config.callbacks.register('confirm_broadcast_', 'pause_broadcast_', 'cancel_broadcast_', prefix=True)
+        async def control_broadcast(callback: CallbackQuery, bot: Bot):
+            action, job_id = callback.data.split('_broadcast_')
+            status = {'confirm': 'running', 'pause': 'paused', 'cancel': 'cancelled'}[action]
+            job = self.jobs.get(int(job_id))
+            if not job:
+                row = await self.db.storage.get_job(int(job_id))
+                if not row or row['status'] not in ACTIVE_JOBS:
+                    return await callback.answer('Рассылка уже завершена')
+                await self.db.storage.save_job(int(job_id), {'status': status})
+                return await callback.answer()
+            job.set_status(status)
+            await self.save_job(job)
+            await callback.answer()
+            if not job.cancelled:
+                await self.update_progress(bot, job)
 
         return router
@@ -1,169 +1,286 @@
-import sqlite3 as sq
-from typing import Any
+import asyncio
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, AsyncIterator
 
 import pytz
-from datetime import datetime
+from datetime import datetime, timedelta
+from time import time
 import locale
 
 from aiogram import Router, F
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
-from aiogram.fsm.context import FSMContext
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, FSInputFile
 
 from bot_constructor.broadcast import Broadcast
-from bot_constructor.utils_funcs import find_resource_path, create_input_file
+from bot_constructor.storage import SQLiteStorage, Storage
+from bot_constructor.utils_funcs import find_resource_path
+
+
+class WriteBuffer:
+    def __init__(self, dbutils, max_size: int = 500, interval: float = 1.0):
+        self.dbutils = dbutils
+        self.max_size = max_size
+        self.interval = interval
+        self.pending: dict[str, tuple[int, bool]] = {}
+        self.failures: dict[str, tuple[str, int]] = {}
+        self.visits: dict[str, tuple[int, str | None]] = {}
+        self.timer: asyncio.TimerHandle | None = None
+        self.tasks: set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self.pending) + len(self.failures) + len(self.visits)
+
+    def add(self, user_id: int | str, is_active: bool, upsert: bool = False) -> None:
+        user_id = str(user_id)
+        previous = self.pending.get(user_id)
+        self.pending[user_id] = (int(is_active), upsert or bool(previous and previous[1]))
+        self.failures.pop(user_id, None)
+        self.schedule()
+
+    def add_failure(self, user_id: int | str, reason: str) -> None:
+        user_id = str(user_id)
+        self.pending.pop(user_id, None)
+        self.failures[user_id] = (reason, int(time()))
+        self.schedule()
+
+    def add_visit(self, user_id: int | str, section: str = None) -> None:
+        user_id = str(user_id)
+        previous = self.visits.get(user_id)
+        self.visits[user_id] = (int(time()), section or (previous and previous[1]))
+        self.schedule()
+
+    def schedule(self) -> None:
+        if len(self) >= self.max_size:
+            self.schedule_flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.interval, self.schedule_flush)
+
+    def schedule_flush(self) -> None:
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        task = asyncio.create_task(self.flush())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def flush(self) -> int:
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        pending, self.pending = self.pending, {}
+        failures, self.failures = self.failures, {}
+        visits, self.visits = self.visits, {}
+        if not pending and not failures and not visits:
+            return 0
+        try:
+            await self.dbutils.storage.write_users(pending, failures, visits)
+        except Exception:
+            self.pending = {**pending, **self.pending}
+            self.failures = {**failures, **self.failures}
+            self.visits = {**visits, **self.visits}
+            raise
+        return len(pending) + len(failures) + len(visits)
+
+    async def close(self) -> None:
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.flush()
 
 
 class DBUtils:
-    def __init__(self, config):
-        self.db = sq.connect(find_resource_path('data/bot.db'))
-        self.db.row_factory = sq.Row
-        self.cur = self.db.cursor()
+    def __init__(self, config, storage: Storage = None):
+        self.storage = storage or SQLiteStorage(find_resource_path('data/bot.db'))
+        self.storage.metrics = config.metrics
+        self.storage.start()
         self.__dict__.update({key: config.jsons[key] for key in ['keyboards', 'messages', 'stats'] if key in config.jsons})
         self.config = config
-        self.start_db()
+        self.metrics = config.metrics
+        self.buffer = WriteBuffer(self)
         self.stat, self.broadcast = (Stats(self), Broadcast(self)) if config.admin_chat_id else (None, None)
 
-    def start_db(self, *queries: list[str | list]):
-        self.cur.execute('''
-                    CREATE TABLE IF NOT EXISTS users (
-                    user_id TEXT PRIMARY KEY,
-                    is_active INTEGER DEFAULT 1
-                    )
-                ''')
-        for query in queries:
-            if query[0].strip().startswith('INSERT'):
-                self.cur.executemany(query[0], query[1])
-            else:
-                self.cur.execute(query[0])
-        self.db.commit()
-
-    def execute_query(self, query: str, *args: Any) -> None | list[tuple]:
-        query_result = self.cur.execute(query, tuple(args))
-        query = query.strip().lower()
-        if query.startswith('select') or 'returning' in query:
-            rows = query_result.fetchall()
-            result = rows
-        elif query.startswith('insert'):
-            result = self.cur.lastrowid
-        else:
-            result = None
-        self.db.commit()
-        return result
+    async def execute_query(self, query: str, *args: Any) -> Any:
+        return await self.storage.execute_query(query, *args)
+
+    async def execute_many(self, query: str, rows: list[tuple]) -> None:
+        await self.storage.execute_many(query, rows)
+
+    async def close(self) -> None:
+        await self.buffer.close()
+        if self.stat:
+            await self.stat.close()
+        await self.storage.close()
 
     async def add_user(self, user_id: int | str) -> None:
-        await self.execute_query(
-            f'''
-                INSERT INTO users (user_id)
-                VALUES ("{user_id}")
-                ON CONFLICT(user_id)
-                DO UPDATE SET is_active = 1;
-            ''')
+        self.buffer.add(user_id, True, upsert=True)
 
     async def count_users(self) -> dict[str, int]:
+        await self.buffer.flush()
         result = {}
         for is_active in [1, 0]:
             key = 'in' * (not is_active) + 'active'
-            result[key] = len(await self.execute_query(f'SELECT * FROM users WHERE is_active = {is_active}'))
+            result[key] = await self.count_by_activity(is_active)
             if self.stat:
-                await self.execute_query(f"UPDATE {self.stat.get_table_name()} SET count = ? WHERE button = ?",
-                                         result[key], key + '_users')
+                await self.stat.set_stat(key + '_users', result[key])
 
         result['all'] = sum(result.values())
         return result
 
+    async def count_by_activity(self, is_active: bool = True, after: str = '', segment: str = None) -> int:
+        await self.buffer.flush()
+        return await self.storage.count_users(is_active, after, segment)
+
     async def get_active_users(self) -> list[int]:
-        results = await self.execute_query('SELECT user_id FROM users WHERE is_active = 1')
-        return [result[0] for result in results]
+        return [user_id async for user_id in self.iter_active_users()]
+
+    async def iter_active_users(self, chunk_size: int = 1000, after: str = '',
+                                segment: str = None) -> AsyncIterator[str]:
+        await self.buffer.flush()
+        last = after
+        while True:
+            users = await self.storage.get_users(last, chunk_size, segment)
+            for user_id in users:
+                yield user_id
+            if len(users) < chunk_size:
+                break
+            last = users[-1]
 
     async def update_activity(self, user_id: int | str, activity: bool = False) -> None:
-        await self.execute_query(f'UPDATE users SET is_active = {int(activity)} WHERE user_id = "{user_id}"')
+        self.buffer.add(user_id, activity)
+
+    async def add_visit(self, user_id: int | str, section: str = None) -> None:
+        """
+        Запоминает время последнего захода пользователя и открытый раздел для сегментов рассылки.
+        """
+
+        self.buffer.add_visit(user_id, section)
+
+    async def mark_failed(self, user_id: int | str, reason: str) -> None:
+        """
+        Помечает пользователя неактивным и запоминает, почему до него не дошло сообщение.
+
+        :param reason: Причина из delivery.PERMANENT: blocked, deactivated или chat_not_found
+        :type reason: str
+        """
+
+        self.buffer.add_failure(user_id, reason)
 
 
 class Stats:
-    def __init__(self, dbutils: DBUtils):
+    export_pages = 1024
+    export_compress = True
+
+    def __init__(self, dbutils: DBUtils, flush_interval: float = 5.0):
         self.dbutils = dbutils
         self.config = dbutils.config
-        self.db = dbutils.db
-        self.cur = self.db.cursor()
         self.admin_chat = self.config.admin_chat_id
         self.tz = pytz.timezone('Asia/Irkutsk')
-        locale.setlocale(category=locale.LC_ALL, locale="Russian")
-        self.base_args = {'reply_markup': self.config.keyboards.get('stat'), **self.config.default_args}
-        self.start_db()
+        for name in ['Russian', 'ru_RU.UTF-8']:
+            try:
+                locale.setlocale(category=locale.LC_ALL, locale=name)
+                break
+            except locale.Error:
+                continue
+        self.buttons: list[str] = []
+        self.seeded: set[str] = set()
+        self.tables: dict[str, dict[str, int]] = {}
+        self.reports: dict[str, str] = {}
+        self.base_args = None
+        self.load_content()
+        self.period, self.period_until = '', 0.0
+        self.counters: dict[tuple[str, str], int] = {}
+        self.flush_interval = flush_interval
+        self.timer: asyncio.TimerHandle | None = None
+        self.tasks: set[asyncio.Task] = set()
         self.router = self.set_router()
 
-    def start_db(self) -> None:
-        table = self.get_table_name()
-        self.cur.execute(f'''
-                            CREATE TABLE IF NOT EXISTS {table} (
-                            button text PRIMARY KEY,
-                            count INTEGER DEFAULT 0
-                            )
-                        ''')
-        self.cur.executemany(f'INSERT OR IGNORE INTO {table} (button) VALUES (?)',
-                             [(btn,) for btn in self.config.jsons['stats'] + ['active_users', 'inactive_users']])
-        self.db.commit()
+    def load_content(self) -> None:
+        self.base_args = {'reply_markup': self.config.keyboards.get('stat'), **self.config.default_args}
+        self.buttons = self.config.jsons['stats'] + ['active_users', 'inactive_users']
+        self.seeded.clear()
+        self.tables.clear()
+        self.reports.clear()
 
     def set_router(self) -> Router:
         router = Router()
 
         @router.message(Command('stat'), F.chat.id == self.config.admin_chat_id)
-        async def stat_cmd(message: Message, state: FSMContext):
+        async def stat_cmd(message: Message):
             await message.delete()
-            await message.answer(**await self.format_stat(state))
+            args = await self.format_stat()
+            response = await message.answer(**args)
+            self.config.remember_render(response, self.config.renders.get_fingerprint(args))
 
         @router.message(Command('db'), F.chat.id == self.config.admin_chat_id)
         async def db_cmd(message: Message):
             await message.delete()
-            await message.answer_document(create_input_file(self.config.data_folder / 'bot.db'),
-                                          caption='База данных <b>успешно</b> выгружена ✅', parse_mode='HTML')
+            with TemporaryDirectory() as folder:
+                path = await self.dbutils.storage.export(Path(folder), self.export_pages, self.export_compress)
+                if not path:
+                    return await message.answer('Выгрузка доступна только для базы SQLite')
+                await message.answer_document(FSInputFile(path, filename=f'{datetime.now(tz=self.tz):%Y-%m-%d}_{path.name}'),
+                                              caption='База данных <b>успешно</b> выгружена ✅', parse_mode='HTML')
 
-        @router.callback_query(F.data == 'stat')
-        async def stat(callback: CallbackQuery, state: FSMContext):
+        @self.config.callbacks.register('stat')
+        async def stat(callback: CallbackQuery):
+            args = await self.format_stat()
+            fingerprint = self.config.check_render(callback, args)
+            if fingerprint is None:
+                return await callback.answer('Вы на первой странице 🏠')
             try:
-                await callback.message.edit_text(**await self.format_stat(state))
-            except TelegramBadRequest:
-                await callback.answer('Вы на первой странице 🏠')
-
-        @router.callback_query(F.data.startswith('stat'))
-        async def stat_scroll(callback: CallbackQuery, state: FSMContext):
-            stats = (await state.get_data()).get('stat') or await self.get_stats()
-            current = stats.index(callback.message.html_text)
-            current += 1 if callback.data.endswith('forward') else -1
-            if 0 <= current < len(stats):
-                await callback.message.edit_text(stats[current], **self.base_args)
+                response = await callback.message.edit_text(**args)
+            except TelegramBadRequest as e:
+                if 'message is not modified' not in e.message:
+                    raise
+                self.config.remember_render(callback.message, fingerprint)
+                return await callback.answer('Вы на первой странице 🏠')
+            self.config.remember_render(response if isinstance(response, Message) else callback.message, fingerprint)
+
+        @self.config.callbacks.register('stat', prefix=True)
+        async def stat_scroll(callback: CallbackQuery):
+            name, _, page = callback.data.rpartition('_')
+            if not page.isdigit():
+                name, page = callback.data, '0'
+            page = int(page) + (1 if name.endswith('forward') else -1)
+            text = await self.get_page(page)
+            if text:
+                await callback.message.edit_text(**self.get_page_args(text, page))
             else:
                 await callback.answer('Больше значений нет 😢')
 
         return router
 
     def get_stat_name(self, stat: str) -> str | None:
-        for key, value in self.config.jsons['keyboards'].items():
-            for callback, text in value.items():
-                if callback == stat:
-                    return text
-        return None
-
-    def get_table_name(self) -> str:
-        now = datetime.now(tz=self.tz)
-        month, year = now.month, now.year
-        return f'stats_{month}_{year}'
-
-    async def get_table(self, table_name: str) -> dict[str, int]:
-        table_name = table_name or self.get_table_name()
-        entries = await self.dbutils.execute_query(f'SELECT * FROM {table_name}')
+        return self.config.navigation.labels.get(stat)
+
+    def get_period(self) -> str:
+        if time() >= self.period_until:
+            now = datetime.now(tz=self.tz)
+            self.period = f'{now.year}-{now.month:02}'
+            next_month = (now.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0, second=0,
+                                                                           microsecond=0)
+            self.period_until = next_month.timestamp()
+        return self.period
+
+    async def get_table(self, period: str = '') -> dict[str, int]:
+        period = period or self.get_period()
+        if period in self.tables:
+            return self.tables[period]
+        await self.flush()
+        stats = await self.dbutils.storage.get_stats(period)
+        order = {btn: i for i, btn in enumerate(self.buttons)}
         result = {}
-        for entry in entries:
-            btn = entry[0]
-            result[self.get_stat_name(btn) or btn] = entry[1]
+        for btn in sorted(stats, key=lambda btn: order.get(btn, len(order))):
+            result[self.get_stat_name(btn) or btn] = stats[btn]
+        if period < self.get_period():
+            self.tables[period] = result
         return result
 
-    async def get_stat(self, table_name: str = '', temp: dict[str, int] = None) -> tuple[int, Any, int | Any, str]:
+    async def get_stat(self, period: str = '', temp: dict[str, int] = None) -> tuple[int, Any, int | Any, str]:
         if temp is None:
             temp = {}
-        table = await self.get_table(table_name)
+        table = await self.get_table(period)
         result, total, users = [], 0, []
         for text, count in table.items():
             if text.endswith('users'):
@@ -174,28 +291,80 @@ class Stats:
                 total += count
         return sum(users), *users, total, '\n'.join(result)
 
-    async def get_stats(self) -> list[str]:
+    async def get_periods(self) -> list[str]:
+        await self.flush()
+        return await self.dbutils.storage.get_periods()
+
+    async def get_report(self, period: str, previous: str = None) -> str:
+        if period in self.reports:
+            return self.reports[period]
         template = self.config.messages.get('stat')['text']
+        temp = await self.get_table(previous) if previous else {}
+        year, month_number = period.split('-')
+        month = datetime.strptime(month_number, '%m').strftime('%B')
+        report = f'<b>{month}, {year}\n</b>\n{template.format(*await self.get_stat(period, temp))}'
+        if period < self.get_period():
+            self.reports[period] = report
+        return report
+
+    async def get_page(self, page: int, periods: list[str] = None) -> str | None:
+        periods = periods or await self.get_periods()
+        if not 0 <= page < len(periods):
+            return None
         main_text = self.config.messages.get('all_stat')['text'].format(*await self.get_stat())
-        months = []
-        temp = {}
-        tables = await self.dbutils.execute_query('SELECT name FROM sqlite_master WHERE type="table"')
-        for table in tables:
-            table = table[0]
-            if not table.startswith('stats'):
-                continue
-            month_number, year = table.replace('stats_', '').split('_')
-            month = datetime.strptime(month_number.rjust(2, '0'), '%m').strftime('%B')
-            header = f'{month}, {year}'
-            record_stat = template.format(*await self.get_stat(table, temp))
-            months.append(f'<b>{header}\n</b>\n{record_stat}')
-            temp = await self.get_table(table)
-        return [f'{main_text}\n\n<blockquote>🗓 {month}</blockquote>' for month in months][::-1]
-
-    async def format_stat(self, state: FSMContext) -> dict[str, str]:
-        stat_months = await self.get_stats()
-        await state.update_data(stat=stat_months)
-        return {'text': stat_months[0], **self.base_args}
+        previous = periods[page + 1] if page + 1 < len(periods) else None
+        return f'{main_text}\n\n<blockquote>🗓 {await self.get_report(periods[page], previous)}</blockquote>'
+
+    async def get_stats(self) -> list[str]:
+        periods = await self.get_periods()
+        return [await self.get_page(page, periods) for page in range(len(periods))]
+
+    def get_page_args(self, text: str, page: int) -> dict[str, Any]:
+        args = {**self.base_args, 'text': text}
+        kb = self.base_args.get('reply_markup')
+        if kb:
+            args['reply_markup'] = InlineKeyboardMarkup(inline_keyboard=[
+                [btn.model_copy(update={'callback_data': f'{btn.callback_data}_{page}'})
+                 if (btn.callback_data or '').startswith('stat_') else btn for btn in row]
+                for row in kb.inline_keyboard])
+        return args
+
+    async def format_stat(self) -> dict[str, Any]:
+        return self.get_page_args(await self.get_page(0), 0)
 
     async def increase_stat(self, button: str) -> None:
-        await self.dbutils.execute_query(f'UPDATE {self.get_table_name()} SET count = count + 1 WHERE button = {button}')
+        key = (self.get_period(), button)
+        self.counters[key] = self.counters.get(key, 0) + 1
+        if self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.flush_interval, self.schedule_flush)
+
+    async def set_stat(self, button: str, count: int) -> None:
+        await self.dbutils.storage.set_stat(self.get_period(), button, count)
+
+    def schedule_flush(self) -> None:
+        self.timer = None
+        task = asyncio.create_task(self.flush())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def flush(self) -> None:
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        counters, self.counters = self.counters, {}
+        periods = ({period for period, _ in counters} | {self.get_period()}) - self.seeded
+        if not counters and not periods:
+            return
+        seeds = [(period, btn) for period in periods for btn in self.buttons]
+        try:
+            await self.dbutils.storage.add_stats(counters, seeds)
+        except Exception:
+            for key, count in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + count
+            raise
+        self.seeded |= periods
+
+    async def close(self) -> None:
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.flush()
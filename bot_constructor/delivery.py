@@ -0,0 +1,213 @@
+import asyncio
+import random
+from collections import Counter, deque
+from time import monotonic
+from typing import Any, AsyncIterable, Callable
+
+from aiogram.exceptions import (TelegramRetryAfter, TelegramAPIError, AiogramError, TelegramBadRequest,
+                                TelegramForbiddenError, TelegramNetworkError, TelegramServerError,
+                                TelegramUnauthorizedError, TelegramEntityTooLarge)
+from aiogram.types import User
+
+from bot_constructor.rate_limiter import RateLimiter
+
+SENT = 'sent'
+RETRY_AFTER = 'retry_after'
+TRANSIENT = 'transient'
+BAD_PAYLOAD = 'bad_payload'
+PERMANENT = ('blocked', 'deactivated', 'chat_not_found')
+CHAT_ERRORS = {'blocked': 'blocked', 'kicked': 'blocked', "can't initiate": 'blocked', 'deactivated': 'deactivated',
+               'chat not found': 'chat_not_found', 'user not found': 'chat_not_found',
+               'peer_id_invalid': 'chat_not_found'}
+
+
+def classify(error: Exception) -> str:
+    """
+    Определяет исход неудачной отправки: retry_after, transient, bad_payload или постоянная ошибка из PERMANENT.
+    """
+
+    if isinstance(error, TelegramRetryAfter):
+        return RETRY_AFTER
+    if isinstance(error, (TelegramUnauthorizedError, TelegramEntityTooLarge)):
+        return BAD_PAYLOAD
+    if isinstance(error, (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError)):
+        return TRANSIENT
+    if isinstance(error, (TelegramForbiddenError, TelegramBadRequest)):
+        message = error.message.lower()
+        for text, outcome in CHAT_ERRORS.items():
+            if text in message:
+                return outcome
+        return 'blocked' if isinstance(error, TelegramForbiddenError) else BAD_PAYLOAD
+    return TRANSIENT
+
+
+class BroadcastJob:
+    def __init__(self, job_id: int, params: dict, sender: User, admin_params: dict, status: str = 'running',
+                 cursor: str = '', done: list[str] = None, sent: int = 0, failed: int = 0):
+        self.id = job_id
+        self.params = params
+        self.sender = sender
+        self.admin_params = admin_params
+        self.status = status
+        self.cursor = cursor
+        self.skip = set(done or [])
+        self.sent, self.failed = sent, failed
+        self.outcomes: Counter[str] = Counter()
+        self.error: str | None = None
+        self.total = 0
+        self.samples: deque[tuple[float, int]] = deque(maxlen=10)
+        self.pending: deque[str] = deque()
+        self.finished: set[str] = set()
+        self.saved_status = status
+        self.resumed = asyncio.Event()
+        if status == 'running':
+            self.resumed.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.status in ('cancelled', 'failed', 'released')
+
+    def pause(self) -> None:
+        self.status = 'paused'
+        self.resumed.clear()
+
+    def resume(self) -> None:
+        self.status = 'running'
+        self.resumed.set()
+
+    def cancel(self) -> None:
+        self.status = 'cancelled'
+        self.resumed.set()
+
+    def fail(self, error: str) -> None:
+        self.status = 'failed'
+        self.error = error
+        self.resumed.set()
+
+    def release(self) -> None:
+        self.status = 'released'
+        self.resumed.set()
+
+    def set_status(self, status: str) -> None:
+        {'running': self.resume, 'paused': self.pause, 'cancelled': self.cancel}[status]()
+
+    async def wait(self) -> bool:
+        await self.resumed.wait()
+        return not self.cancelled
+
+    def dispatch(self, user_id: str) -> None:
+        self.pending.append(user_id)
+
+    def count(self, outcome: str) -> None:
+        delivered = outcome == SENT
+        self.sent += delivered
+        self.failed += not delivered
+        self.outcomes[outcome] += 1
+
+    def complete(self, user_id: str, outcome: str) -> None:
+        self.count(outcome)
+        self.finished.add(user_id)
+        while self.pending and self.pending[0] in self.finished:
+            self.cursor = self.pending.popleft()
+            self.finished.discard(self.cursor)
+
+    @property
+    def processed(self) -> int:
+        return self.sent + self.failed
+
+    def tick(self) -> None:
+        self.samples.append((monotonic(), self.processed))
+
+    def get_progress(self) -> dict[str, int | float | None]:
+        rate = 0.0
+        if len(self.samples) > 1:
+            (start, first), (end, last) = self.samples[0], self.samples[-1]
+            rate = (last - first) / (end - start)
+        remaining = max(self.total - self.processed, 0)
+        return {'sent': self.sent, 'failed': self.failed, 'remaining': remaining, 'rate': rate,
+                'eta': remaining / rate if rate else None}
+
+    def get_done(self) -> list[str]:
+        return sorted(self.finished | {user_id for user_id in self.skip if user_id > self.cursor})
+
+
+class Delivery:
+    workers = 20
+    max_retries = 3
+    retry_queue_size = 1000
+    backoff = 0.5
+    max_payload_errors = 3
+    limiter: RateLimiter
+
+    async def handle_failure(self, user_id: str, reason: str) -> None:
+        pass
+
+    async def record(self, job: BroadcastJob, user_id: str, outcome: str, error: str = None) -> None:
+        job.complete(user_id, outcome)
+        if outcome in PERMANENT:
+            await self.handle_failure(user_id, outcome)
+        elif outcome == BAD_PAYLOAD and job.outcomes[BAD_PAYLOAD] >= self.max_payload_errors and not job.cancelled:
+            job.fail(error or outcome)
+
+    async def send_message(self, user_id: str, func: Callable, params: dict[str, str]) -> tuple[str, str | None]:
+        try:
+            await func(chat_id=user_id, **params)
+        except (TelegramAPIError, AiogramError, asyncio.TimeoutError) as e:
+            outcome = classify(e)
+            if outcome == RETRY_AFTER:
+                self.limiter.pause(e.retry_after)
+            elif outcome != TRANSIENT:
+                print(f"Ошибка отправки пользователю {user_id} ({outcome}): {e}")
+            return outcome, str(e)
+        return SENT, None
+
+    async def deliver(self, users: AsyncIterable[str], func: Callable, params: dict[str, Any], job: BroadcastJob) -> int:
+        queue = asyncio.Queue(maxsize=self.workers * 2)
+        retries = asyncio.Queue(maxsize=self.retry_queue_size)
+
+        async def process(user_id: str, attempt: int) -> None:
+            while await job.wait():
+                await self.limiter.acquire(user_id)
+                outcome, error = await self.send_message(user_id, func, params)
+                if outcome not in (RETRY_AFTER, TRANSIENT):
+                    return await self.record(job, user_id, outcome, error)
+                attempt += 1
+                if attempt > self.max_retries:
+                    return await self.record(job, user_id, outcome, error)
+                if outcome == TRANSIENT:
+                    await asyncio.sleep(self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+                    continue
+                try:
+                    retries.put_nowait((user_id, attempt))
+                    return
+                except asyncio.QueueFull:
+                    continue
+
+        async def worker() -> None:
+            while True:
+                if not retries.empty():
+                    await process(*retries.get_nowait())
+                    continue
+                user_id = await queue.get()
+                if user_id is None:
+                    break
+                await process(user_id, 0)
+            while not retries.empty():
+                await process(*retries.get_nowait())
+
+        tasks = [asyncio.create_task(worker()) for _ in range(self.workers)]
+        try:
+            async for user_id in users:
+                if job.cancelled:
+                    break
+                if user_id in job.skip:
+                    continue
+                job.dispatch(user_id)
+                await queue.put(user_id)
+            for _ in tasks:
+                await queue.put(None)
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        return job.sent
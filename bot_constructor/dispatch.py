@@ -0,0 +1,54 @@
+from typing import Any, Callable
+
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.types import CallbackQuery
+
+
+class CallbackDispatcher:
+    def __init__(self):
+        """
+        Таблица обработчиков callback-кнопок: словарь точных совпадений и префиксное дерево
+        для параметризованных данных, например {btn}_{key} из edit_keyboard. Поиск не зависит от числа обработчиков.
+        """
+
+        self.exact: dict[str, CallableObject] = {}
+        self.trie: dict[str, dict] = {}
+
+    def add(self, data: str, handler: Callable, prefix: bool = False) -> None:
+        handler = CallableObject(handler)
+        if not prefix:
+            self.exact[data] = handler
+            return
+        node = self.trie
+        for char in data:
+            node = node.setdefault(char, {})
+        node[''] = handler
+
+    def register(self, *data: str, prefix: bool = False) -> Callable:
+        def decorator(handler: Callable) -> Callable:
+            for item in data:
+                self.add(item, handler, prefix)
+            return handler
+        return decorator
+
+    def resolve(self, data: str) -> CallableObject | None:
+        handler = self.exact.get(data)
+        if handler:
+            return handler
+        node = self.trie
+        for char in data:
+            node = node.get(char)
+            if node is None:
+                break
+            handler = node.get('', handler)
+        return handler
+
+    def get_name(self, data: str) -> str | None:
+        handler = self.resolve(data)
+        return handler.callback.__name__ if handler else None
+
+    async def dispatch(self, callback: CallbackQuery, fallback: Callable, data: dict[str, Any]) -> Any:
+        handler = self.resolve(callback.data or '')
+        if handler is None:
+            return await fallback(callback)
+        return await handler.call(callback, **data)
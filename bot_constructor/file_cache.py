@@ -0,0 +1,36 @@
+import hashlib
+from pathlib import Path
+
+import orjson
+
+
+class FileIdCache:
+    def __init__(self, path: Path):
+        """
+        Хранит file_id загруженных в Telegram изображений, чтобы не отправлять их повторно.
+
+        :param path: Путь к JSON файлу кэша
+        :type path: Path
+        """
+
+        self.path = path
+        self.entries: dict[str, dict[str, str]] = orjson.loads(path.read_bytes()) if path.exists() else {}
+
+    @staticmethod
+    def get_hash(file_path: Path) -> str:
+        return hashlib.sha256(file_path.read_bytes()).hexdigest()
+
+    def get(self, file: str, file_hash: str) -> str | None:
+        entry = self.entries.get(file)
+        if entry and entry['hash'] == file_hash:
+            return entry['file_id']
+        return None
+
+    def set(self, file: str, file_hash: str, file_id: str) -> None:
+        self.entries[file] = {'hash': file_hash, 'file_id': file_id}
+        self.save()
+
+    def save(self) -> None:
+        tmp_path = self.path.with_suffix('.tmp')
+        tmp_path.write_bytes(orjson.dumps(self.entries, option=orjson.OPT_INDENT_2))
+        tmp_path.replace(self.path)
@@ -0,0 +1,58 @@
+from collections import OrderedDict
+
+from aiogram.types import InlineKeyboardMarkup
+
+from bot_constructor.metrics import MetricsRegistry
+
+
+class KeyboardCache:
+    def __init__(self, max_size: int = 1024, metrics: MetricsRegistry = None):
+        """
+        LRU производных клавиатур: (шаблон, ключ, key_first) -> клавиатура с переписанными callback-данными.
+        Запись устаревает, как только шаблон с таким названием заменен, например при перезагрузке.
+        get возвращает копию со своими списками рядов: в нее можно добавлять ряды и кнопки, но сами кнопки общие
+        с кэшем, их нужно заменять, а не менять на месте.
+
+        :param max_size: Сколько клавиатур помнить
+        :type max_size: int, optional
+        :param metrics: Реестр метрик для счетчика bot_keyboard_cache_total
+        :type metrics: MetricsRegistry, optional
+        """
+
+        self.max_size = max_size
+        self.metrics = metrics
+        self.entries: OrderedDict[tuple[str, str, bool], tuple[InlineKeyboardMarkup, InlineKeyboardMarkup]] = OrderedDict()
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def build(template: InlineKeyboardMarkup, key: str, key_first: bool = False) -> InlineKeyboardMarkup:
+        return InlineKeyboardMarkup(inline_keyboard=[
+            [btn.model_copy(update={'callback_data': f'{key}_{btn.callback_data}' if key_first
+                                    else f'{btn.callback_data}_{key}'}) if btn.callback_data else btn for btn in row]
+            for row in template.inline_keyboard])
+
+    @staticmethod
+    def copy(kb: InlineKeyboardMarkup) -> InlineKeyboardMarkup:
+        return kb.model_copy(update={'inline_keyboard': [list(row) for row in kb.inline_keyboard]})
+
+    def get(self, template: InlineKeyboardMarkup, name: str, key: str, key_first: bool = False) -> InlineKeyboardMarkup:
+        cache_key = (name, key, key_first)
+        entry = self.entries.get(cache_key)
+        if entry and entry[0] is template:
+            self.hits += 1
+            if self.metrics:
+                self.metrics.inc('bot_keyboard_cache_total', result='hit')
+            self.entries.move_to_end(cache_key)
+            return self.copy(entry[1])
+        self.misses += 1
+        if self.metrics:
+            self.metrics.inc('bot_keyboard_cache_total', result='miss')
+        kb = self.build(template, key, key_first)
+        self.entries[cache_key] = (template, kb)
+        self.entries.move_to_end(cache_key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return self.copy(kb)
+
+    def clear(self) -> None:
+        self.entries.clear()
@@ -0,0 +1,168 @@
+import re
+from bisect import bisect_left
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import CallbackQuery, TelegramObject
+from aiohttp import web
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ESCAPES = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n'})
+NUMBERS = re.compile(r'\d+')
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    def __init__(self, max_series: int = 500):
+        """
+        Хранит гистограммы задержек и счетчики и отдает их в текстовом формате Prometheus.
+
+        :param max_series: Сколько разных наборов меток хранить на одну метрику, остальные попадают в label="other"
+        :type max_series: int, optional
+        """
+
+        self.max_series = max_series
+        self.histograms: dict[str, dict[tuple, Histogram]] = {}
+        self.counters: dict[str, dict[tuple, int]] = {}
+        self.help: dict[str, str] = {}
+        self.runner: web.AppRunner | None = None
+
+    def get_key(self, series: dict, labels: dict[str, str]) -> tuple:
+        key = tuple(labels.items())
+        if key not in series and len(series) >= self.max_series:
+            key = tuple((name, 'other') for name in labels)
+        return key
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        series = self.histograms.setdefault(name, {})
+        key = self.get_key(series, labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        histogram.observe(value)
+
+    def inc(self, name: str, value: int = 1, **labels: str) -> None:
+        series = self.counters.setdefault(name, {})
+        key = self.get_key(series, labels)
+        series[key] = series.get(key, 0) + value
+
+    def describe(self, name: str, text: str) -> None:
+        self.help[name] = text
+
+    @staticmethod
+    def format_labels(labels: tuple, extra: str = '') -> str:
+        values = [f'{name}="{str(value).translate(ESCAPES)}"' for name, value in labels]
+        if extra:
+            values.append(extra)
+        return '{' + ','.join(values) + '}' if values else ''
+
+    def render(self) -> str:
+        lines = []
+        for name, series in self.counters.items():
+            if name in self.help:
+                lines.append(f'# HELP {name} {self.help[name]}')
+            lines.append(f'# TYPE {name} counter')
+            lines.extend(f'{name}{self.format_labels(key)} {value}' for key, value in list(series.items()))
+        for name, series in self.histograms.items():
+            if name in self.help:
+                lines.append(f'# HELP {name} {self.help[name]}')
+            lines.append(f'# TYPE {name} histogram')
+            for key, histogram in list(series.items()):
+                total = 0
+                for bound, count in zip((*histogram.buckets, '+Inf'), histogram.counts):
+                    total += count
+                    le = f'le="{bound}"'
+                    lines.append(f'{name}_bucket{self.format_labels(key, le)} {total}')
+                lines.append(f'{name}_sum{self.format_labels(key)} {histogram.sum}')
+                lines.append(f'{name}_count{self.format_labels(key)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: Path | str) -> None:
+        path = Path(path)
+        tmp_path = path.with_suffix('.tmp')
+        tmp_path.write_text(self.render(), encoding='utf-8')
+        tmp_path.replace(path)
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.render(), content_type='text/plain', charset='utf-8')
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 9090) -> None:
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle_metrics)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+
+    async def stop(self) -> None:
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+class MetricsMiddleware(BaseMiddleware):
+    def __init__(self, registry: MetricsRegistry, callbacks=None):
+        """
+        Замеряет время и ошибки обработчиков апдейтов.
+
+        :param registry: Реестр метрик
+        :type registry: MetricsRegistry
+        :param callbacks: Таблица обработчиков кнопок, чтобы нажатия подписывались найденным в ней обработчиком, а не handle_callback
+        :type callbacks: CallbackDispatcher, optional
+        """
+
+        self.registry = registry
+        self.callbacks = callbacks
+
+    def get_name(self, event: TelegramObject, data: dict[str, Any]) -> str:
+        if self.callbacks and isinstance(event, CallbackQuery):
+            name = self.callbacks.get_name(event.data or '')
+            if name:
+                return name
+        handler_object = data.get('handler')
+        return handler_object.callback.__name__ if handler_object else 'unknown'
+
+    async def __call__(self, handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: dict[str, Any]) -> Any:
+        name = self.get_name(event, data)
+        started = perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.registry.inc('bot_handler_errors_total', handler=name)
+            raise
+        finally:
+            elapsed = perf_counter() - started
+            self.registry.observe('bot_handler_seconds', elapsed, handler=name, event=type(event).__name__)
+            if isinstance(event, CallbackQuery) and event.data:
+                self.registry.observe('bot_callback_seconds', elapsed, callback=NUMBERS.sub('#', event.data))
+
+
+class MetricsRequestMiddleware(BaseRequestMiddleware):
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+
+    async def __call__(self, make_request, bot: Bot, method):
+        name = type(method).__name__
+        started = perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            self.registry.inc('bot_api_errors_total', method=name, error=type(e).__name__)
+            raise
+        finally:
+            self.registry.observe('bot_api_seconds', perf_counter() - started, method=name)
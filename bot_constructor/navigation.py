@@ -0,0 +1,61 @@
+class Navigation:
+    def __init__(self, keyboards: dict[str, dict]):
+        """
+        Индекс переходов между разделами, построенный за один проход по клавиатурам.
+
+        :param keyboards: Клавиатуры из keyboards.json: раздел -> {callback: текст или вложенный ряд кнопок}
+        :type keyboards: dict[str, dict]
+        """
+
+        self.parents: dict[str, str] = {}
+        self.children: dict[str, list[str]] = {}
+        self.labels: dict[str, str] = {}
+        for key, kb in keyboards.items():
+            children = self.children.setdefault(key, [])
+            for callback, text in self.iter_buttons(kb):
+                children.append(callback)
+                self.labels.setdefault(callback, text)
+                if callback != key:
+                    self.parents.setdefault(callback, key)
+
+    @staticmethod
+    def iter_buttons(kb: dict) -> list[tuple[str, str]]:
+        buttons, stack, seen = [], [iter(kb.items())], {id(kb)}
+        while stack:
+            item = next(stack[-1], None)
+            if item is None:
+                stack.pop()
+                continue
+            callback, text = item
+            if isinstance(text, dict):
+                if id(text) not in seen:
+                    seen.add(id(text))
+                    stack.append(iter(text.items()))
+            else:
+                buttons.append((callback, text))
+        return buttons
+
+    def get_parent(self, key: str) -> str | None:
+        return self.parents.get(key)
+
+    def get_path(self, key: str) -> list[str]:
+        path, seen = [key], {key}
+        parent = self.parents.get(key)
+        while parent and parent not in seen:
+            path.append(parent)
+            seen.add(parent)
+            parent = self.parents.get(parent)
+        return path[::-1]
+
+    def find_cycles(self) -> list[list[str]]:
+        cycles, done = [], set()
+        for key in self.parents:
+            path, index = [], {}
+            while key and key not in done and key not in index:
+                index[key] = len(path)
+                path.append(key)
+                key = self.parents.get(key)
+            if key in index:
+                cycles.append(path[index[key]:])
+            done.update(path)
+        return cycles
@@ -0,0 +1,95 @@
+import asyncio
+from time import monotonic
+
+
+class RateLimiter:
+    def __init__(self, rate: float = 25, burst: float = 1, chat_interval: float = 1.0, max_chats: int = 10_000):
+        """
+        Ограничивает скорость отправки: общий token bucket плюс минимальный интервал между сообщениями в один чат.
+
+        :param rate: Сообщений в секунду на весь бот
+        :type rate: float, optional
+        :param burst: Емкость корзины — сколько сообщений можно отправить разом
+        :type burst: float, optional
+        :param chat_interval: Минимальный интервал между сообщениями в один чат, в секундах
+        :type chat_interval: float, optional
+        :param max_chats: Сколько чатов помнить, прежде чем чистить устаревшие записи
+        :type max_chats: int, optional
+        """
+
+        self.rate = rate
+        self.burst = burst
+        self.chat_interval = chat_interval
+        self.max_chats = max_chats
+        self.tokens = burst
+        self.updated = monotonic()
+        self.paused_until = 0.0
+        self.chats: dict[int | str, float] = {}
+        self.lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, monotonic() + seconds)
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def wait_chat(self, chat_id: int | str) -> None:
+        now = monotonic()
+        ready = self.chats.get(chat_id, 0.0)
+        self.chats[chat_id] = max(now, ready) + self.chat_interval
+        if len(self.chats) > self.max_chats:
+            self.chats = {chat: until for chat, until in self.chats.items() if until > now}
+        if ready > now:
+            await asyncio.sleep(ready - now)
+
+    async def acquire(self, chat_id: int | str = None) -> None:
+        if chat_id is not None:
+            await self.wait_chat(chat_id)
+        async with self.lock:
+            while True:
+                now = monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class SharedRateLimiter(RateLimiter):
+    def __init__(self, rate: float, schedule, paused, burst: float = 1, chat_interval: float = 1.0,
+                 max_chats: int = 10_000):
+        """
+        Общий бюджет скорости для нескольких процессов. Процессы по очереди занимают слоты отправки
+        в разделяемых значениях multiprocessing, интервал между сообщениями в один чат считается локально.
+
+        :param schedule: multiprocessing.Value('d') — время следующего свободного слота
+        :param paused: multiprocessing.Value('d') — до какого времени отправка приостановлена после RetryAfter
+        """
+
+        super().__init__(rate, burst, chat_interval, max_chats)
+        self.schedule = schedule
+        self.paused = paused
+
+    def pause(self, seconds: float) -> None:
+        with self.paused.get_lock():
+            self.paused.value = max(self.paused.value, monotonic() + seconds)
+
+    async def acquire(self, chat_id: int | str = None) -> None:
+        if chat_id is not None:
+            await self.wait_chat(chat_id)
+        while True:
+            now = monotonic()
+            if now < self.paused.value:
+                await asyncio.sleep(self.paused.value - now)
+                continue
+            with self.schedule.get_lock():
+                slot = max(now - (self.burst - 1) / self.rate, self.schedule.value)
+                self.schedule.value = slot + 1 / self.rate
+            if slot > now:
+                await asyncio.sleep(slot - now)
+            if monotonic() >= self.paused.value:
+                return
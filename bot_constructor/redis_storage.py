@@ -0,0 +1,253 @@
+from functools import partial
+from time import time
+from typing import Any, Callable
+
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.redis import RedisStorage as RedisFSMStorage
+from redis.asyncio import Redis
+
+from bot_constructor.storage import ACTIVE_JOBS, SEGMENT_COLUMNS, Storage, parse_segment
+
+ACQUIRE_LOCK = '''
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return 1
+end
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+'''
+RELEASE_LOCK = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+'''
+
+class RedisStorage(Storage):
+    def __init__(self, redis: Redis | str, prefix: str = 'bot'):
+        """
+        Хранилище на общем сервере Redis: несколько процессов бота видят одних пользователей, статистику и рассылки.
+
+        :param redis: Клиент Redis с decode_responses=True или URL, например redis://localhost:6379/0
+        :type redis: Redis | str
+        :param prefix: Префикс всех ключей бота
+        :type prefix: str, optional
+        """
+
+        self.redis = Redis.from_url(redis, decode_responses=True) if isinstance(redis, str) else redis
+        self.prefix = prefix
+        self.fsm = RedisFSMStorage(self.redis)
+        self.acquire_script = self.redis.register_script(ACQUIRE_LOCK)
+        self.release_script = self.redis.register_script(RELEASE_LOCK)
+
+    def get_key(self, *parts: Any) -> str:
+        return ':'.join(map(str, (self.prefix, *parts)))
+
+    def get_users_key(self, is_active: bool | int) -> str:
+        return self.get_key('users', 'active' if is_active else 'inactive')
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+    async def write_users(self, users: dict[str, tuple[int, bool]], failures: dict[str, tuple[str, int]] = None,
+                          visits: dict[str, tuple[int, str | None]] = None) -> None:
+        await self.measure('write_users', self.run_write_users(users, failures or {}, visits or {}))
+
+    async def run_write_users(self, users: dict[str, tuple[int, bool]], failures: dict[str, tuple[str, int]],
+                              visits: dict[str, tuple[int, str | None]]) -> None:
+        updates = [user_id for user_id, (_, upsert) in users.items() if not upsert] + list(failures)
+        updates += [user_id for user_id in visits if user_id not in users or not users[user_id][1]]
+        sections = [user_id for user_id, (_, section) in visits.items() if section]
+        activated = [user_id for user_id, (is_active, _) in users.items() if is_active]
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id in updates:
+                pipe.zscore(self.get_users_key(True), user_id)
+                pipe.zscore(self.get_users_key(False), user_id)
+            if sections:
+                pipe.hmget(self.get_key('section'), sections)
+            if activated:
+                pipe.zmscore(self.get_key('first_seen'), activated)
+                pipe.zmscore(self.get_key('last_seen'), activated)
+            result = await pipe.execute() if updates or sections or activated else []
+        missing = {user_id for i, user_id in enumerate(updates) if result[2 * i] is None and result[2 * i + 1] is None}
+        result = iter(result[2 * len(updates):])
+        previous = dict(zip(sections, next(result))) if sections else {}
+        seen = dict(zip(activated, zip(next(result), next(result)))) if activated else {}
+        now = int(time())
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for user_id, (is_active, upsert) in users.items():
+                if user_id in missing:
+                    continue
+                pipe.zadd(self.get_users_key(is_active), {user_id: 0})
+                pipe.zrem(self.get_users_key(not is_active), user_id)
+                if upsert:
+                    pipe.zadd(self.get_key('first_seen'), {user_id: now}, nx=True)
+                    pipe.zadd(self.get_key('last_seen'), {user_id: now})
+                if is_active:
+                    first_seen, last_seen = seen[user_id]
+                    self.activate(pipe, user_id, first_seen or (now if upsert else None), now if upsert else last_seen)
+                else:
+                    self.deactivate(pipe, user_id)
+                pipe.hdel(self.get_key('failures'), user_id)
+            for user_id, (reason, failed_at) in failures.items():
+                if user_id in missing:
+                    continue
+                pipe.zadd(self.get_users_key(False), {user_id: 0})
+                pipe.zrem(self.get_users_key(True), user_id)
+                self.deactivate(pipe, user_id)
+                pipe.hset(self.get_key('failures'), user_id, f'{reason}:{failed_at}')
+            for user_id, (last_seen, section) in visits.items():
+                if user_id in missing:
+                    continue
+                pipe.zadd(self.get_key('last_seen'), {user_id: last_seen})
+                pipe.zadd(self.get_key('active', 'last_seen'), {user_id: last_seen}, xx=True)
+                if section and previous.get(user_id) != section:
+                    if previous.get(user_id):
+                        pipe.zrem(self.get_key('section', previous[user_id]), user_id)
+                    pipe.zadd(self.get_key('section', section), {user_id: 0})
+                    pipe.hset(self.get_key('section'), user_id, section)
+            await pipe.execute()
+
+    def activate(self, pipe, user_id: str, first_seen: float | None, last_seen: float | None) -> None:
+        """
+        Копирует время пользователя в индексы active:first_seen и active:last_seen, по которым ZCOUNT
+        считает сегменты seen: и new: только среди активных пользователей.
+        """
+
+        for column, score in (('first_seen', first_seen), ('last_seen', last_seen)):
+            if score is not None:
+                pipe.zadd(self.get_key('active', column), {user_id: score})
+
+    def deactivate(self, pipe, user_id: str) -> None:
+        for column in SEGMENT_COLUMNS.values():
+            pipe.zrem(self.get_key('active', column), user_id)
+
+    async def filter_users(self, user_ids: list[str], key: str, since: int = None) -> list[str]:
+        if not user_ids:
+            return []
+        scores = await self.redis.zmscore(key, user_ids)
+        return [user_id for user_id, score in zip(user_ids, scores)
+                if score is not None and (since is None or score >= since)]
+
+    async def scan_users(self, key: str, after: str, limit: int, check: Callable) -> list[str]:
+        """
+        Проходит сортированное множество по возрастанию user_id и оставляет пользователей, прошедших check.
+        """
+
+        users, last = [], after
+        while len(users) < limit:
+            page = await self.redis.zrangebylex(key, f'({last}' if last else '-', '+', start=0, num=limit)
+            users += await check(page)
+            if len(page) < limit:
+                break
+            last = page[-1]
+        return users[:limit]
+
+    async def count_users(self, is_active: bool = True, after: str = '', segment: str = None) -> int:
+        """
+        Считает сегмент по индексам: ZINTERCARD раздела со множеством активных или ZCOUNT по времени.
+        Остаток продолжаемой рассылки (after) так не посчитать — его пользователи выгружаются и проверяются.
+        """
+
+        kind, value = parse_segment(segment)
+        key = self.get_users_key(is_active)
+        start = f'({after}' if after else '-'
+        if kind is None:
+            return await self.measure('count_users', self.redis.zlexcount(key, start, '+'))
+        if after:
+            if kind == 'section':
+                users = await self.redis.zrangebylex(self.get_key('section', value), start, '+')
+            else:
+                users = [user_id for user_id in await self.redis.zrangebyscore(
+                    self.get_key(SEGMENT_COLUMNS[kind]), value, '+inf') if user_id > after]
+            return len(await self.measure('count_users', self.filter_users(users, key)))
+        if kind == 'section':
+            return await self.measure('count_users', self.redis.zintercard(2, [self.get_key('section', value), key]))
+        column = SEGMENT_COLUMNS[kind]
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zcount(self.get_key('active', column), value, '+inf')
+            pipe.zcount(self.get_key(column), value, '+inf')
+            active, total = await self.measure('count_users', pipe.execute())
+        return active if is_active else total - active
+
+    async def get_users(self, after: str = '', limit: int = 1000, segment: str = None) -> list[str]:
+        """
+        Раздел выгружается проходом по своему множеству. Для seen: и new: индекс по времени не упорядочен
+        по user_id, а курсор рассылки требует этого порядка, поэтому проходятся все активные пользователи —
+        столько же, сколько при рассылке всем, и намного быстрее самой рассылки при лимите скорости Telegram.
+        """
+
+        kind, value = parse_segment(segment)
+        key = self.get_users_key(True)
+        if kind is None:
+            return await self.measure('get_users', self.redis.zrangebylex(
+                key, f'({after}' if after else '-', '+', start=0, num=limit))
+        if kind == 'section':
+            return await self.measure('get_users', self.scan_users(
+                self.get_key('section', value), after, limit, partial(self.filter_users, key=key)))
+        return await self.measure('get_users', self.scan_users(
+            key, after, limit, partial(self.filter_users, key=self.get_key('active', SEGMENT_COLUMNS[kind]),
+                                       since=value)))
+
+    async def add_stats(self, counters: dict[tuple[str, str], int], seeds: list[tuple[str, str]] = ()) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for period, button in seeds:
+                pipe.hsetnx(self.get_key('stats', period), button, 0)
+            for (period, button), count in counters.items():
+                pipe.hincrby(self.get_key('stats', period), button, count)
+            periods = {period for period, _ in seeds} | {period for period, _ in counters}
+            if periods:
+                pipe.zadd(self.get_key('stats'), dict.fromkeys(periods, 0))
+            await self.measure('add_stats', pipe.execute())
+
+    async def set_stat(self, period: str, button: str, count: int) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self.get_key('stats', period), button, count)
+            pipe.zadd(self.get_key('stats'), {period: 0})
+            await self.measure('set_stat', pipe.execute())
+
+    async def get_stats(self, period: str) -> dict[str, int]:
+        stats = await self.measure('get_stats', self.redis.hgetall(self.get_key('stats', period)))
+        return {button: int(stats[button]) for button in sorted(stats)}
+
+    async def get_periods(self) -> list[str]:
+        return await self.measure('get_periods', self.redis.zrevrangebylex(self.get_key('stats'), '+', '-'))
+
+    @staticmethod
+    def dump_job(fields: dict[str, Any]) -> dict[str, Any]:
+        return {key: '' if value is None else value for key, value in fields.items()}
+
+    async def create_job(self, fields: dict[str, Any]) -> int:
+        job_id = await self.measure('create_job', self.redis.incr(self.get_key('broadcasts', 'id')))
+        await self.save_job(job_id, {'status': 'running', 'cursor': '', 'done': '[]', 'sent': 0, 'failed': 0, **fields})
+        return job_id
+
+    async def save_job(self, job_id: int, fields: dict[str, Any]) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self.get_key('broadcast', job_id), mapping=self.dump_job(fields))
+            if fields.get('status') in ACTIVE_JOBS:
+                pipe.sadd(self.get_key('broadcasts'), job_id)
+            elif 'status' in fields:
+                pipe.srem(self.get_key('broadcasts'), job_id)
+            await self.measure('save_job', pipe.execute())
+
+    async def get_job(self, job_id: int) -> dict[str, Any] | None:
+        job = await self.measure('get_job', self.redis.hgetall(self.get_key('broadcast', job_id)))
+        if not job:
+            return None
+        return {**job, 'id': int(job_id), 'media': job.get('media') or None,
+                'sent': int(job.get('sent', 0)), 'failed': int(job.get('failed', 0))}
+
+    async def get_jobs(self) -> list[dict[str, Any]]:
+        jobs = [await self.get_job(job_id) for job_id in await self.redis.smembers(self.get_key('broadcasts'))]
+        return sorted((job for job in jobs if job and job['status'] in ACTIVE_JOBS), key=lambda job: job['id'])
+
+    async def acquire_lock(self, name: str, owner: str, ttl: float) -> bool:
+        return bool(await self.acquire_script(keys=[self.get_key('lock', name)], args=[owner, int(ttl * 1000)]))
+
+    async def release_lock(self, name: str, owner: str) -> None:
+        await self.release_script(keys=[self.get_key('lock', name)], args=[owner])
+
+    def get_fsm_storage(self) -> BaseStorage:
+        return self.fsm
@@ -0,0 +1,57 @@
+import asyncio
+from pathlib import Path
+
+
+class ContentWatcher:
+    def __init__(self, config, interval: float = 2.0):
+        """
+        Следит за data/json и data/images опросом файловой системы и перезагружает измененные разделы конфигурации.
+
+        :param config: Конфигурация бота, которую нужно перезагружать
+        :type config: BotConfig
+        :param interval: Период опроса, в секундах
+        :type interval: float, optional
+        """
+
+        self.config = config
+        self.interval = interval
+        self.files: dict[Path, tuple[int, int]] = {}
+        self.task: asyncio.Task | None = None
+
+    def scan(self) -> dict[Path, tuple[int, int]]:
+        files = {}
+        for folder in [self.config.data_folder / 'json', self.config.get_images_dir()]:
+            if not folder.exists():
+                continue
+            for file_path in folder.rglob('*'):
+                if file_path.is_file():
+                    stat = file_path.stat()
+                    files[file_path] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    async def check(self) -> set[Path]:
+        files = await asyncio.to_thread(self.scan)
+        changed = {path for path in files.keys() | self.files.keys() if files.get(path) != self.files.get(path)}
+        self.files = files
+        return changed
+
+    async def run(self) -> None:
+        await self.check()
+        while True:
+            await asyncio.sleep(self.interval)
+            changed = await self.check()
+            if not changed:
+                continue
+            try:
+                await self.config.reload(changed)
+            except Exception as e:
+                print(f'Ошибка перезагрузки конфигурации: {e}')
+
+    async def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+            self.task = None
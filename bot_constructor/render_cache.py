@@ -0,0 +1,64 @@
+from collections import OrderedDict
+from typing import Any
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.methods import DeleteMessage, EditMessageCaption, EditMessageMedia, EditMessageReplyMarkup, EditMessageText
+from aiogram.types import FSInputFile, InputMediaPhoto
+from pydantic import BaseModel
+
+
+class RenderCache:
+    def __init__(self, max_size: int = 10_000):
+        """
+        LRU отпечатков содержимого отправленных экранов: (chat_id, message_id) -> (отпечаток, edit_date).
+        По edit_date видно, что сообщение успели изменить в другом процессе бота.
+
+        :param max_size: Сколько сообщений помнить
+        :type max_size: int, optional
+        """
+
+        self.max_size = max_size
+        self.entries: OrderedDict[tuple[int | str, int], tuple[int, Any]] = OrderedDict()
+        self.saved = 0
+
+    @staticmethod
+    def get_value_key(value: Any) -> Any:
+        if isinstance(value, InputMediaPhoto):
+            return RenderCache.get_value_key(value.media), value.caption
+        if isinstance(value, FSInputFile):
+            return str(value.path)
+        if isinstance(value, BaseModel):
+            return value.model_dump_json(exclude_none=True)
+        return value
+
+    @staticmethod
+    def get_fingerprint(args: dict[str, Any]) -> int:
+        return hash(tuple((key, RenderCache.get_value_key(value)) for key, value in sorted(args.items())))
+
+    def is_current(self, key: tuple[int | str, int], fingerprint: int, edit_date: Any = None) -> bool:
+        if self.entries.get(key) != (fingerprint, edit_date):
+            return False
+        self.entries.move_to_end(key)
+        return True
+
+    def set(self, key: tuple[int | str, int], fingerprint: int, edit_date: Any = None) -> None:
+        self.entries[key] = (fingerprint, edit_date)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, key: tuple[int | str, int]) -> None:
+        self.entries.pop(key, None)
+
+
+class RenderCacheMiddleware(BaseRequestMiddleware):
+    methods = (EditMessageText, EditMessageMedia, EditMessageCaption, EditMessageReplyMarkup, DeleteMessage)
+
+    def __init__(self, cache: RenderCache):
+        self.cache = cache
+
+    async def __call__(self, make_request, bot: Bot, method):
+        if isinstance(method, self.methods) and method.chat_id is not None and method.message_id is not None:
+            self.cache.invalidate((method.chat_id, method.message_id))
+        return await make_request(bot, method)
@@ -0,0 +1,230 @@
+import asyncio
+import multiprocessing as mp
+import queue
+from functools import partial
+from time import monotonic
+from typing import Any, AsyncIterable, AsyncIterator
+from zlib import crc32
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+
+from bot_constructor.delivery import BroadcastJob, Delivery
+from bot_constructor.rate_limiter import SharedRateLimiter
+
+STATUSES = ('running', 'paused', 'cancelled')
+
+
+def get_shard(user_id: str, shards: int) -> int:
+    return crc32(user_id.encode()) % shards
+
+
+class ShardJob(BroadcastJob):
+    def __init__(self, shard: int):
+        super().__init__(shard, {}, None, {})
+        self.results: list[tuple[str, str, str | None]] = []
+
+    def complete(self, user_id: str, outcome: str) -> None:
+        self.count(outcome)
+
+
+class ShardWorker(Delivery):
+    report_interval = 0.2
+    poll_interval = 0.5
+
+    def __init__(self, shard: int, settings: dict[str, Any], tasks: mp.Queue, results: mp.Queue, status, schedule,
+                 paused):
+        """
+        Рассылает свою часть получателей в отдельном процессе и отправляет результаты координатору.
+
+        :param shard: Номер шарда
+        :type shard: int
+        :param settings: Токен и API бота, метод отправки, его аргументы и лимиты скорости
+        :type settings: dict[str, Any]
+        :param tasks: Очередь пачек user_id от координатора, None — пачек больше не будет
+        :type tasks: mp.Queue
+        :param results: Очередь пачек (user_id, исход, ошибка) для координатора, (шард, ошибка или None) — шард закончил
+        :type results: mp.Queue
+        :param status: multiprocessing.Value('i') — индекс статуса рассылки в STATUSES
+        """
+
+        self.shard = shard
+        self.settings = settings
+        self.tasks, self.results, self.status = tasks, results, status
+        self.limiter = SharedRateLimiter(settings['rate'], schedule, paused, settings['burst'])
+        self.job = ShardJob(shard)
+
+    async def record(self, job: ShardJob, user_id: str, outcome: str, error: str = None) -> None:
+        await super().record(job, user_id, outcome, error)
+        job.results.append((user_id, outcome, error))
+
+    async def get_users(self) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        while not self.job.cancelled:
+            try:
+                batch = await loop.run_in_executor(None, partial(self.tasks.get, timeout=self.poll_interval))
+            except queue.Empty:
+                continue
+            if batch is None:
+                return
+            for user_id in batch:
+                yield user_id
+
+    def report(self) -> None:
+        if self.job.results:
+            self.results.put(self.job.results)
+            self.job.results = []
+
+    async def watch(self) -> None:
+        while True:
+            status = STATUSES[self.status.value]
+            if status != self.job.status and self.job.status != 'failed':
+                self.job.set_status(status)
+            self.report()
+            await asyncio.sleep(self.report_interval)
+
+    async def run(self) -> None:
+        settings = self.settings
+        error = None
+        try:
+            bot = Bot(settings['token'], session=AiohttpSession(api=settings['api']), default=settings['default'])
+            watcher = asyncio.create_task(self.watch())
+            try:
+                await self.deliver(self.get_users(), getattr(bot, settings['method']), settings['params'], self.job)
+            finally:
+                watcher.cancel()
+                await bot.session.close()
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            self.report()
+            self.results.put((self.shard, error))
+
+
+def run_shard(*args: Any) -> None:
+    asyncio.run(ShardWorker(*args).run())
+
+
+class ShardedDelivery:
+    batch_size = 100
+    queue_size = 20
+    poll_interval = 0.1
+    exit_timeout = 1.0
+    stop_timeout = 5.0
+
+    def __init__(self, broadcast, bot: Bot, processes: int):
+        """
+        Делит получателей рассылки на шарды по хешу user_id и рассылает их из пула процессов
+        с общим лимитом скорости. Исходы отправки из шардов учитываются в задаче рассылки координатора.
+
+        :param broadcast: Рассылка-координатор: лимиты скорости, учет недоступных пользователей и остановка рассылки
+        :type broadcast: Broadcast
+        :param bot: Бот, от имени которого рассылают процессы
+        :type bot: Bot
+        :param processes: Количество процессов
+        :type processes: int
+        """
+
+        self.broadcast = broadcast
+        self.bot = bot
+        self.processes = processes
+        self.context = mp.get_context('spawn')
+        self.stopping = False
+
+    def get_settings(self, method: str, params: dict[str, Any]) -> dict[str, Any]:
+        limiter = self.broadcast.limiter
+        return {'token': self.bot.token, 'api': self.bot.session.api, 'default': self.bot.default, 'method': method,
+                'params': params, 'rate': limiter.rate, 'burst': limiter.burst}
+
+    @staticmethod
+    def fail_shard(job: BroadcastJob, worker, error: str = None) -> None:
+        job.fail(f'Процесс {worker.name} ' + (f'упал: {error}' if error else f'завершился с кодом {worker.exitcode}'))
+
+    async def put(self, tasks: mp.Queue, batch: list[str] | None, job: BroadcastJob, worker) -> bool:
+        loop = asyncio.get_running_loop()
+        while not job.cancelled:
+            try:
+                await loop.run_in_executor(None, partial(tasks.put, batch, timeout=self.poll_interval))
+                return True
+            except queue.Full:
+                if not worker.is_alive():
+                    self.fail_shard(job, worker)
+        return False
+
+    async def collect(self, results: mp.Queue, workers: list, job: BroadcastJob, status) -> None:
+        """
+        Учитывает исходы из шардов, пока все они не закончат, в том числе после остановки рассылки — так курсор
+        учитывает уже отправленное. Шард, который упал или завершился без итогового сообщения, останавливает
+        рассылку с ошибкой, иначе его пачки ждали бы вечно.
+        """
+
+        loop = asyncio.get_running_loop()
+        finished, exited = set(), {}
+        while len(finished) < len(workers):
+            if job.cancelled or self.stopping:
+                status.value = STATUSES.index('cancelled')
+            elif job.status in STATUSES:
+                status.value = STATUSES.index(job.status)
+            for shard, worker in enumerate(workers):
+                if shard not in finished and not worker.is_alive():
+                    exited.setdefault(shard, monotonic())
+                    if monotonic() - exited[shard] > self.exit_timeout:
+                        return self.fail_shard(job, worker)
+            try:
+                batch = await loop.run_in_executor(None, partial(results.get, timeout=self.poll_interval))
+            except queue.Empty:
+                continue
+            if isinstance(batch, tuple):
+                shard, error = batch
+                finished.add(shard)
+                if error:
+                    return self.fail_shard(job, workers[shard], error)
+                continue
+            for user_id, outcome, error in batch:
+                await self.broadcast.record(job, user_id, outcome, error)
+
+    async def deliver(self, users: AsyncIterable[str], method: str, params: dict[str, Any], job: BroadcastJob) -> int:
+        context = self.context
+        status = context.Value('i', STATUSES.index(job.status), lock=False)
+        schedule, paused = context.Value('d', 0.0), context.Value('d', 0.0)
+        results = context.Queue()
+        shards = [context.Queue(self.queue_size) for _ in range(self.processes)]
+        settings = self.get_settings(method, params)
+        workers = [context.Process(target=run_shard, args=(shard, settings, tasks, results, status, schedule, paused),
+                                   name=f'broadcast_shard_{shard}', daemon=True) for shard, tasks in enumerate(shards)]
+        for worker in workers:
+            worker.start()
+        collector = asyncio.create_task(self.collect(results, workers, job, status))
+        try:
+            batches = [[] for _ in shards]
+            async for user_id in users:
+                if job.cancelled:
+                    break
+                if user_id in job.skip:
+                    continue
+                job.dispatch(user_id)
+                shard = get_shard(user_id, self.processes)
+                batches[shard].append(user_id)
+                if len(batches[shard]) >= self.batch_size:
+                    await self.put(shards[shard], batches[shard], job, workers[shard])
+                    batches[shard] = []
+            for tasks, batch, worker in zip(shards, batches, workers):
+                if batch:
+                    await self.put(tasks, batch, job, worker)
+                await self.put(tasks, None, job, worker)
+            await asyncio.shield(collector)
+        finally:
+            self.stopping = True
+            status.value = STATUSES.index('cancelled')
+            try:
+                await asyncio.wait_for(collector, self.stop_timeout)
+            except asyncio.TimeoutError:
+                pass
+            for worker in workers:
+                await asyncio.get_running_loop().run_in_executor(None, partial(worker.join, self.stop_timeout))
+                if worker.is_alive():
+                    worker.terminate()
+            for tasks in shards:
+                tasks.cancel_join_thread()
+        return job.sent
@@ -0,0 +1,61 @@
+import hashlib
+import pickle
+from pathlib import Path
+from typing import Any
+
+import aiogram
+
+SNAPSHOT_VERSION = 1
+
+
+def get_fingerprint(json_dir: Path, params: dict[str, Any]) -> str:
+    digest = hashlib.sha256(repr(sorted(params.items())).encode())
+    for file_path in sorted(json_dir.rglob('*.json')):
+        digest.update(file_path.relative_to(json_dir).as_posix().encode())
+        digest.update(file_path.read_bytes())
+    return digest.hexdigest()
+
+
+def get_header(json_dir: Path, params: dict[str, Any]) -> dict[str, Any]:
+    return {'version': SNAPSHOT_VERSION, 'aiogram': aiogram.__version__,
+            'fingerprint': get_fingerprint(json_dir, params)}
+
+
+def save_snapshot(path: Path, header: dict[str, Any], data: dict[str, Any]) -> None:
+    tmp_path = path.with_suffix('.tmp')
+    with tmp_path.open('wb') as file:
+        pickle.dump(header, file, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(data, file, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_path.replace(path)
+
+
+def load_snapshot(path: Path, header: dict[str, Any]) -> dict[str, Any] | None:
+    if not path.exists():
+        return None
+    try:
+        with path.open('rb') as file:
+            if pickle.load(file) != header:
+                return None
+            return pickle.load(file)
+    except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+
+
+def main() -> None:
+    import argparse
+
+    import orjson
+
+    from bot_constructor.bot_config import BotConfig
+
+    parser = argparse.ArgumentParser(description='Собирает снимок конфигурации бота из JSON файлов')
+    parser.add_argument('data_folder', type=Path, nargs='?', help='Папка с данными бота, по умолчанию ./data')
+    parser.add_argument('--default-args', type=orjson.loads, help='default_args бота в JSON, например {"parse_mode": "HTML"}')
+    parser.add_argument('--back-exclusions', nargs='+', help='back_exclusions бота')
+    args = parser.parse_args()
+    back_exclusions = tuple(args.back_exclusions) if args.back_exclusions else None
+    path = BotConfig.build_snapshot(args.data_folder, args.default_args, back_exclusions)
+    print(f'Снимок конфигурации сохранен: {path}')
+
+if __name__ == '__main__':
+    main()
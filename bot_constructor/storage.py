@@ -0,0 +1,460 @@
+import asyncio
+import gzip
+import shutil
+import sqlite3 as sq
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from time import perf_counter, time
+from typing import Any, Callable, Mapping
+
+import orjson
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StorageKey
+
+ACTIVE_JOBS = ('running', 'paused')
+SEGMENT_COLUMNS = {'seen': 'last_seen', 'new': 'first_seen'}
+
+
+def parse_segment(segment: str | None) -> tuple[str | None, Any]:
+    """
+    Разбирает сегмент аудитории рассылки: seen:<дней> — заходили за последние дни, new:<дней> — пришли
+    за последние дни, section:<раздел> — последним открывали раздел.
+
+    :return: (вид сегмента, timestamp начала периода или раздел), (None, None) — все пользователи
+    """
+
+    if not segment:
+        return None, None
+    kind, _, value = segment.partition(':')
+    if kind in SEGMENT_COLUMNS:
+        return kind, int(time()) - int(value) * 86400
+    if kind == 'section':
+        return kind, value
+    raise ValueError(f'Неизвестный сегмент: {segment}')
+
+
+class Storage(ABC):
+    """
+    Общий интерфейс хранилища: пользователи, счетчики статистики, задачи рассылок, блокировки и FSM.
+    """
+
+    metrics = None
+
+    def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def measure(self, operation: str, awaitable) -> Any:
+        started = perf_counter()
+        try:
+            return await awaitable
+        except Exception:
+            if self.metrics:
+                self.metrics.inc('bot_db_errors_total', operation=operation)
+            raise
+        finally:
+            if self.metrics:
+                self.metrics.observe('bot_db_seconds', perf_counter() - started, operation=operation)
+
+    @abstractmethod
+    async def write_users(self, users: dict[str, tuple[int, bool]], failures: dict[str, tuple[str, int]] = None,
+                          visits: dict[str, tuple[int, str | None]] = None) -> None:
+        """
+        Записывает активность пользователей.
+
+        :param users: user_id -> (is_active, upsert). Без upsert обновляются только существующие пользователи
+        :type users: dict[str, tuple[int, bool]]
+        :param failures: user_id -> (причина, timestamp) для пользователей, до которых не дошла рассылка.
+            Такие пользователи становятся неактивными, а при возвращении причина стирается
+        :type failures: dict[str, tuple[str, int]], optional
+        :param visits: user_id -> (timestamp, раздел или None) последнего захода существующих пользователей
+        :type visits: dict[str, tuple[int, str | None]], optional
+        """
+
+        raise NotImplementedError
+
+    @abstractmethod
+    async def count_users(self, is_active: bool = True, after: str = '', segment: str = None) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_users(self, after: str = '', limit: int = 1000, segment: str = None) -> list[str]:
+        """
+        Возвращает следующую страницу активных пользователей сегмента (см. parse_segment) по возрастанию user_id.
+        """
+
+        raise NotImplementedError
+
+    @abstractmethod
+    async def add_stats(self, counters: dict[tuple[str, str], int], seeds: list[tuple[str, str]] = ()) -> None:
+        """
+        Прибавляет счетчики (period, button) -> count и создает нулевые записи seeds.
+        """
+
+        raise NotImplementedError
+
+    @abstractmethod
+    async def set_stat(self, period: str, button: str, count: int) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_stats(self, period: str) -> dict[str, int]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_periods(self) -> list[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def create_job(self, fields: dict[str, Any]) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def save_job(self, job_id: int, fields: dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_job(self, job_id: int) -> dict[str, Any] | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_jobs(self) -> list[dict[str, Any]]:
+        """
+        Возвращает незавершенные (running, paused) рассылки.
+        """
+
+        raise NotImplementedError
+
+    @abstractmethod
+    async def acquire_lock(self, name: str, owner: str, ttl: float) -> bool:
+        """
+        Захватывает или продлевает блокировку, общую для всех процессов бота.
+        """
+
+        raise NotImplementedError
+
+    @abstractmethod
+    async def release_lock(self, name: str, owner: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_fsm_storage(self) -> BaseStorage:
+        raise NotImplementedError
+
+    async def export(self, folder: Path, pages: int = 1024, compress: bool = True) -> Path | None:
+        """
+        Сохраняет согласованную копию хранилища в папку folder.
+
+        :return: Путь к копии или None, если хранилище не поддерживает выгрузку
+        """
+
+        return None
+
+
+class SQLiteStorage(Storage):
+    UPSERT_USER = '''
+        INSERT INTO users (user_id, is_active, first_seen, last_seen)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(user_id)
+        DO UPDATE SET is_active = excluded.is_active, last_seen = excluded.last_seen, failure = NULL, failed_at = NULL
+    '''
+    UPDATE_USER = 'UPDATE users SET is_active = ?, failure = NULL, failed_at = NULL WHERE user_id = ?'
+    FAIL_USER = 'UPDATE users SET is_active = 0, failure = ?, failed_at = ? WHERE user_id = ?'
+    VISIT_USER = 'UPDATE users SET last_seen = ?, section = COALESCE(?, section) WHERE user_id = ?'
+    COLUMNS = {'users':      {'failure': 'TEXT', 'failed_at': 'INTEGER', 'first_seen': 'INTEGER',
+                              'last_seen': 'INTEGER', 'section': 'TEXT'},
+               'broadcasts': {'segment': 'TEXT'}}
+    INDEXES = {'users_last_seen':  'users (is_active, last_seen, user_id)',
+               'users_first_seen': 'users (is_active, first_seen, user_id)',
+               'users_section':    'users (is_active, section, user_id)'}
+    UPSERT_STAT = '''
+        INSERT INTO stats (period, button, count)
+        VALUES (?, ?, ?)
+        ON CONFLICT(period, button)
+        DO UPDATE SET count = count + excluded.count
+    '''
+    SEED_STAT = 'INSERT OR IGNORE INTO stats (period, button) VALUES (?, ?)'
+    ACQUIRE_LOCK = '''
+        INSERT INTO locks (name, owner, expires)
+        VALUES (?, ?, ?)
+        ON CONFLICT(name)
+        DO UPDATE SET owner = excluded.owner, expires = excluded.expires
+        WHERE locks.owner = excluded.owner OR locks.expires < ?
+    '''
+
+    def __init__(self, path: Path | str):
+        """
+        Хранилище в локальном файле SQLite. Все запросы выполняются в отдельном потоке.
+
+        :param path: Путь к файлу базы данных
+        :type path: Path | str
+        """
+
+        self.path = path
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='bot_db')
+        self.db = self.run_sync(self.connect)
+        self.fsm = SQLiteFSMStorage(self)
+
+    def connect(self) -> sq.Connection:
+        db = sq.connect(self.path, check_same_thread=False, cached_statements=256)
+        db.row_factory = sq.Row
+        db.execute('PRAGMA journal_mode = WAL')
+        db.execute('PRAGMA synchronous = NORMAL')
+        return db
+
+    def run_sync(self, func: Callable, *args: Any) -> Any:
+        return self.executor.submit(func, *args).result()
+
+    async def run(self, func: Callable, *args: Any, operation: str = None) -> Any:
+        return await self.measure(operation or func.__name__,
+                                  asyncio.get_running_loop().run_in_executor(self.executor, func, *args))
+
+    def start(self) -> None:
+        self.run_sync(self.start_db, ['''
+                    CREATE TABLE IF NOT EXISTS stats (
+                    period TEXT,
+                    button TEXT,
+                    count INTEGER DEFAULT 0,
+                    PRIMARY KEY (period, button)
+                    ) WITHOUT ROWID
+                '''], ['''
+                    CREATE TABLE IF NOT EXISTS broadcasts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    text TEXT,
+                    media TEXT,
+                    sender TEXT,
+                    admin TEXT,
+                    status TEXT DEFAULT 'running',
+                    cursor TEXT DEFAULT '',
+                    done TEXT DEFAULT '[]',
+                    sent INTEGER DEFAULT 0,
+                    failed INTEGER DEFAULT 0
+                    )
+                '''], ['''
+                    CREATE TABLE IF NOT EXISTS locks (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT,
+                    expires REAL
+                    )
+                '''], ['''
+                    CREATE TABLE IF NOT EXISTS fsm (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT
+                    )
+                '''])
+        self.run_sync(self.migrate)
+
+    def start_db(self, *queries: list[str | list]):
+        cur = self.db.cursor()
+        cur.execute('''
+                    CREATE TABLE IF NOT EXISTS users (
+                    user_id TEXT PRIMARY KEY,
+                    is_active INTEGER DEFAULT 1
+                    )
+                ''')
+        cur.execute('CREATE INDEX IF NOT EXISTS users_active ON users (is_active, user_id)')
+        for query in queries:
+            if query[0].strip().startswith('INSERT'):
+                cur.executemany(query[0], query[1])
+            else:
+                cur.execute(query[0])
+        self.db.commit()
+
+    def migrate(self) -> None:
+        with self.db:
+            for table, table_columns in self.COLUMNS.items():
+                columns = {row[1] for row in self.db.execute(f'PRAGMA table_info({table})')}
+                for column, column_type in table_columns.items():
+                    if column not in columns:
+                        self.db.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+            for name, index in self.INDEXES.items():
+                self.db.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {index}')
+            tables = self.db.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB 'stats_*_*'").fetchall()
+            for table in tables:
+                table = table[0]
+                month, year = table.removeprefix('stats_').split('_')
+                self.db.execute(f'''
+                        INSERT INTO stats (period, button, count)
+                        SELECT ?, button, count FROM {table} WHERE true
+                        ON CONFLICT(period, button)
+                        DO UPDATE SET count = count + excluded.count
+                    ''', (f'{year}-{int(month):02}',))
+                self.db.execute(f'DROP TABLE {table}')
+
+    def run_query(self, query: str, args: tuple = ()) -> None | int | list[sq.Row]:
+        query_result = self.db.execute(query, args)
+        query = query.strip().lower()
+        if query.startswith('select') or 'returning' in query:
+            result = query_result.fetchall()
+        elif query.startswith('insert'):
+            result = query_result.lastrowid
+        else:
+            result = None
+        self.db.commit()
+        return result
+
+    def run_many(self, *batches: tuple[str, list[tuple]]) -> None:
+        with self.db:
+            for query, rows in batches:
+                if rows:
+                    self.db.executemany(query, rows)
+
+    async def execute_query(self, query: str, *args: Any) -> None | int | list[sq.Row]:
+        return await self.run(self.run_query, query, args, operation=query.split(None, 1)[0].lower())
+
+    async def execute_many(self, query: str, rows: list[tuple]) -> None:
+        await self.run(self.run_many, (query, rows))
+
+    async def close(self) -> None:
+        await self.run(self.db.close)
+        self.executor.shutdown()
+
+    async def write_users(self, users: dict[str, tuple[int, bool]], failures: dict[str, tuple[str, int]] = None,
+                          visits: dict[str, tuple[int, str | None]] = None) -> None:
+        now, visits = int(time()), visits or {}
+        upserts, updates = [], []
+        for user_id, (is_active, upsert) in users.items():
+            if upsert:
+                seen = visits[user_id][0] if user_id in visits else now
+                upserts.append((user_id, is_active, seen, seen))
+            else:
+                updates.append((is_active, user_id))
+        failed = [(reason, failed_at, user_id) for user_id, (reason, failed_at) in (failures or {}).items()]
+        visited = [(seen, section, user_id) for user_id, (seen, section) in visits.items()]
+        await self.run(self.run_many, (self.UPSERT_USER, upserts), (self.UPDATE_USER, updates),
+                       (self.FAIL_USER, failed), (self.VISIT_USER, visited))
+
+    @staticmethod
+    def get_segment_filter(segment: str | None) -> tuple[str, tuple]:
+        kind, value = parse_segment(segment)
+        if kind is None:
+            return '', ()
+        column = SEGMENT_COLUMNS.get(kind, 'section')
+        return f' AND {column} {"=" if column == "section" else ">="} ?', (value,)
+
+    async def count_users(self, is_active: bool = True, after: str = '', segment: str = None) -> int:
+        condition, args = self.get_segment_filter(segment)
+        rows = await self.execute_query(f'SELECT COUNT(*) FROM users WHERE is_active = ?{condition} AND user_id > ?',
+                                        int(is_active), *args, after)
+        return rows[0][0]
+
+    async def get_users(self, after: str = '', limit: int = 1000, segment: str = None) -> list[str]:
+        """
+        Раздел выгружается по индексу users_section. Для seen: и new: SQLite выбирает users_active: по индексу
+        времени пришлось бы сортировать весь сегмент на каждой странице. Поэтому выгрузка такого сегмента
+        проходит всех активных пользователей — на 200 тысячах это доли секунды (benchmarks/segments.py).
+        """
+
+        condition, args = self.get_segment_filter(segment)
+        rows = await self.execute_query(
+            f'SELECT user_id FROM users WHERE is_active = 1{condition} AND user_id > ? ORDER BY user_id LIMIT ?',
+            *args, after, limit)
+        return [row[0] for row in rows]
+
+    async def add_stats(self, counters: dict[tuple[str, str], int], seeds: list[tuple[str, str]] = ()) -> None:
+        rows = [(period, button, count) for (period, button), count in counters.items()]
+        await self.run(self.run_many, (self.SEED_STAT, list(seeds)), (self.UPSERT_STAT, rows))
+
+    async def set_stat(self, period: str, button: str, count: int) -> None:
+        await self.run(self.run_many, (self.SEED_STAT, [(period, button)]),
+                       ('UPDATE stats SET count = ? WHERE period = ? AND button = ?', [(count, period, button)]))
+
+    async def get_stats(self, period: str) -> dict[str, int]:
+        rows = await self.execute_query('SELECT button, count FROM stats WHERE period = ?', period)
+        return {row[0]: row[1] for row in rows}
+
+    async def get_periods(self) -> list[str]:
+        rows = await self.execute_query('SELECT DISTINCT period FROM stats ORDER BY period DESC')
+        return [row[0] for row in rows]
+
+    async def create_job(self, fields: dict[str, Any]) -> int:
+        return await self.execute_query(f'INSERT INTO broadcasts ({", ".join(fields)}) VALUES ({", ".join("?" * len(fields))})',
+                                        *fields.values())
+
+    async def save_job(self, job_id: int, fields: dict[str, Any]) -> None:
+        await self.execute_query(f'UPDATE broadcasts SET {", ".join(f"{key} = ?" for key in fields)} WHERE id = ?',
+                                 *fields.values(), job_id)
+
+    async def get_job(self, job_id: int) -> dict[str, Any] | None:
+        rows = await self.execute_query('SELECT * FROM broadcasts WHERE id = ?', job_id)
+        return dict(rows[0]) if rows else None
+
+    async def get_jobs(self) -> list[dict[str, Any]]:
+        rows = await self.execute_query("SELECT * FROM broadcasts WHERE status IN ('running', 'paused')")
+        return [dict(row) for row in rows]
+
+    def run_lock(self, name: str, owner: str, ttl: float) -> bool:
+        now = time()
+        with self.db:
+            self.db.execute(self.ACQUIRE_LOCK, (name, owner, now + ttl, now))
+            row = self.db.execute('SELECT owner FROM locks WHERE name = ?', (name,)).fetchone()
+        return row[0] == owner
+
+    async def acquire_lock(self, name: str, owner: str, ttl: float) -> bool:
+        return await self.run(self.run_lock, name, owner, ttl)
+
+    async def release_lock(self, name: str, owner: str) -> None:
+        await self.execute_query('DELETE FROM locks WHERE name = ? AND owner = ?', name, owner)
+
+    def get_fsm_storage(self) -> BaseStorage:
+        return self.fsm
+
+    def backup(self, target: Path, pages: int = 1024, sleep: float = 0.005) -> None:
+        source = sq.connect(self.path)
+        db = sq.connect(target)
+        try:
+            source.execute('BEGIN')
+            source.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchall()
+            source.backup(db, pages=pages, sleep=sleep)
+        finally:
+            source.rollback()
+            source.close()
+            db.close()
+
+    def run_export(self, folder: Path, pages: int, compress: bool) -> Path:
+        path = folder / Path(self.path).name
+        self.backup(path, pages)
+        if not compress:
+            return path
+        with open(path, 'rb') as file, gzip.open(f'{path}.gz', 'wb', compresslevel=6) as archive:
+            shutil.copyfileobj(file, archive, 1024 ** 2)
+        path.unlink()
+        return Path(f'{path}.gz')
+
+    async def export(self, folder: Path, pages: int = 1024, compress: bool = True) -> Path | None:
+        return await self.measure('export', asyncio.to_thread(self.run_export, folder, pages, compress))
+
+
+class SQLiteFSMStorage(BaseStorage):
+    def __init__(self, storage: SQLiteStorage):
+        self.storage = storage
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+    async def set_state(self, key: StorageKey, state: str | State = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        await self.storage.execute_query('''
+                    INSERT INTO fsm (key, state, data) VALUES (?, ?, '{}')
+                    ON CONFLICT(key) DO UPDATE SET state = excluded.state
+                ''', self.key_builder.build(key), state)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        rows = await self.storage.execute_query('SELECT state FROM fsm WHERE key = ?', self.key_builder.build(key))
+        return rows[0][0] if rows else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await self.storage.execute_query('''
+                    INSERT INTO fsm (key, data) VALUES (?, ?)
+                    ON CONFLICT(key) DO UPDATE SET data = excluded.data
+                ''', self.key_builder.build(key), orjson.dumps(dict(data)).decode())
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        rows = await self.storage.execute_query('SELECT data FROM fsm WHERE key = ?', self.key_builder.build(key))
+        return orjson.loads(rows[0][0]) if rows and rows[0][0] else {}
+
+    async def close(self) -> None:
+        pass
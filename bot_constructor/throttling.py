@@ -0,0 +1,99 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import AiogramError, TelegramAPIError
+from aiogram.types import CallbackQuery, TelegramObject
+
+from bot_constructor.metrics import MetricsRegistry
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    def __init__(self, registry: MetricsRegistry, rate: float = 2, burst: float = 10, max_users: int = 10_000,
+                 exempt: tuple[int, ...] = ()):
+        """
+        Ограничивает частоту апдейтов от одного пользователя (token bucket) и схлопывает частые нажатия
+        кнопок одного сообщения: пока экран отрисовывается, из новых нажатий выполнится только последнее.
+        На отброшенные нажатия отвечается пустым answerCallbackQuery, чтобы у пользователя не висела загрузка.
+
+        :param registry: Реестр метрик для счетчиков отклоненных и схлопнутых апдейтов
+        :type registry: MetricsRegistry
+        :param rate: Апдейтов в секунду на пользователя
+        :type rate: float, optional
+        :param burst: Сколько апдейтов пользователь может прислать разом
+        :type burst: float, optional
+        :param max_users: Сколько пользователей помнить, самые давние вытесняются
+        :type max_users: int, optional
+        :param exempt: ID пользователей и чатов без ограничений, например админ-чат
+        :type exempt: tuple[int, ...], optional
+        """
+
+        self.registry = registry
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self.exempt = set(exempt)
+        self.buckets: OrderedDict[int, tuple[float, float]] = OrderedDict()
+        self.rendering: set[tuple[int, int, int]] = set()
+        self.pending: dict[tuple[int, int, int], tuple[Callable, TelegramObject, dict[str, Any]]] = {}
+
+    def allow(self, user_id: int) -> bool:
+        now = monotonic()
+        tokens, updated = self.buckets.pop(user_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        allowed = tokens >= 1
+        self.buckets[user_id] = (tokens - allowed, now)
+        if len(self.buckets) > self.max_users:
+            self.buckets.popitem(last=False)
+        return allowed
+
+    @staticmethod
+    async def drop(event: TelegramObject) -> None:
+        if not isinstance(event, CallbackQuery):
+            return
+        try:
+            await event.answer()
+        except (TelegramAPIError, AiogramError):
+            pass
+
+    @staticmethod
+    def get_render_key(event: TelegramObject) -> tuple[int, int, int] | None:
+        if not isinstance(event, CallbackQuery) or not event.message:
+            return None
+        return event.from_user.id, event.message.chat.id, event.message.message_id
+
+    async def __call__(self, handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: dict[str, Any]) -> Any:
+        user = data.get('event_from_user')
+        chat = data.get('event_chat')
+        if not user or user.id in self.exempt or (chat and chat.id in self.exempt):
+            return await handler(event, data)
+        if not self.allow(user.id):
+            self.registry.inc('bot_throttled_total', event=type(event).__name__)
+            return await self.drop(event)
+
+        key = self.get_render_key(event)
+        if key is None:
+            return await handler(event, data)
+        if key in self.rendering:
+            replaced = self.pending.get(key)
+            self.pending[key] = (handler, event, data)
+            if replaced:
+                self.registry.inc('bot_coalesced_total')
+                await self.drop(replaced[1])
+            return None
+
+        self.rendering.add(key)
+        try:
+            result = await handler(event, data)
+            while key in self.pending:
+                handler, event, data = self.pending.pop(key)
+                result = await handler(event, data)
+            return result
+        finally:
+            self.rendering.discard(key)
+            dropped = self.pending.pop(key, None)
+            if dropped:
+                self.registry.inc('bot_coalesced_total')
+                await self.drop(dropped[1])
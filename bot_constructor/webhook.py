@@ -0,0 +1,159 @@
+import asyncio
+import signal
+from time import perf_counter
+
+import orjson
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+from pydantic import ValidationError
+
+
+class WebhookServer:
+    def __init__(self, config, bot: Bot, dp: Dispatcher = None, path: str = '/webhook', secret_token: str = None,
+                 concurrency: int = 50, queue_size: int = 1000, drain_timeout: float = 30.0):
+        """
+        Принимает апдейты вебхуком Telegram и обрабатывает их пулом из concurrency обработчиков.
+        Апдейт подтверждается сразу после постановки в очередь, при полной очереди запрос ждет места в ней.
+
+        :param config: Конфиг бота, роутеры которого подключаются к диспетчеру
+        :type config: BotConfig
+        :param bot: Бот, для которого обрабатываются апдейты
+        :type bot: Bot
+        :param dp: Диспетчер с уже подключенными config.include_routers роутерами, по умолчанию создается новый
+        :type dp: Dispatcher, optional
+        :param path: Путь, на который Telegram присылает апдейты
+        :type path: str, optional
+        :param secret_token: Секрет из setWebhook, апдейты без него отклоняются
+        :type secret_token: str, optional
+        :param concurrency: Сколько апдейтов обрабатывается одновременно
+        :type concurrency: int, optional
+        :param queue_size: Сколько принятых апдейтов может ждать обработки
+        :type queue_size: int, optional
+        :param drain_timeout: Сколько секунд при остановке ждать обработки принятых апдейтов
+        :type drain_timeout: float, optional
+        """
+
+        self.config = config
+        self.bot = bot
+        if dp is None:
+            dp = Dispatcher()
+            config.include_routers(dp)
+        self.dp = dp
+        self.path = path
+        self.secret_token = secret_token
+        self.concurrency = concurrency
+        self.drain_timeout = drain_timeout
+        self.metrics = config.metrics
+        self.queue: asyncio.Queue[tuple[Update, float]] = asyncio.Queue(queue_size)
+        self.workers: list[asyncio.Task] = []
+        self.runner: web.AppRunner | None = None
+        self.accepting = False
+        self.receiving = 0
+        self.active = 0
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret_token and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != self.secret_token:
+            return web.Response(status=401)
+        if not self.accepting:
+            return web.Response(status=503)
+        try:
+            update = Update.model_validate(await request.json(loads=orjson.loads), context={'bot': self.bot})
+        except (ValueError, ValidationError) as e:
+            print(f'Некорректный апдейт: {e}')
+            return web.Response(status=400)
+        self.receiving += 1
+        try:
+            await self.queue.put((update, perf_counter()))
+        finally:
+            self.receiving -= 1
+        self.metrics.inc('bot_webhook_updates_total')
+        return web.Response()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({'status': 'ok'})
+
+    async def handle_ready(self, request: web.Request) -> web.Response:
+        ready = self.accepting and not self.queue.full()
+        return web.json_response({'ready': ready, 'queued': self.queue.qsize(), 'active': self.active},
+                                 status=200 if ready else 503)
+
+    async def work(self) -> None:
+        while True:
+            update, received = await self.queue.get()
+            self.metrics.observe('bot_webhook_queue_seconds', perf_counter() - received)
+            self.active += 1
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                print(f'Ошибка обработки апдейта {update.update_id}: {e}')
+            finally:
+                self.active -= 1
+                self.queue.task_done()
+
+    async def drain(self) -> None:
+        while True:
+            await self.queue.join()
+            if not self.receiving:
+                return
+            await asyncio.sleep(0.01)
+
+    async def start(self, host: str = '0.0.0.0', port: int = 8080, url: str = None) -> str:
+        """
+        Запускает хуки старта диспетчера, пул обработчиков и HTTP сервер.
+
+        :param url: Публичный адрес вебхука для setWebhook. Без него вебхук должен быть уже установлен
+        :type url: str, optional
+        :return: Адрес, на котором слушает сервер
+        """
+
+        await self.dp.emit_startup(bot=self.bot, dispatcher=self.dp, **self.dp.workflow_data)
+        self.workers = [asyncio.create_task(self.work()) for _ in range(self.concurrency)]
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get('/health', self.handle_health)
+        app.router.add_get('/ready', self.handle_ready)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        self.accepting = True
+        if url:
+            await self.bot.set_webhook(url, secret_token=self.secret_token,
+                                       allowed_updates=self.dp.resolve_used_update_types())
+        host, port = self.runner.addresses[0][:2]
+        return f'http://{host}:{port}'
+
+    async def stop(self) -> None:
+        """
+        Перестает принимать апдейты, дожидается уже принятых и запускает хуки остановки,
+        которые сбрасывают в базу буфер записей и статистику.
+        """
+
+        self.accepting = False
+        try:
+            await asyncio.wait_for(self.drain(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            print(f'Не дождались обработки {self.queue.qsize() + self.receiving + self.active} апдейтов')
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+        await self.dp.emit_shutdown(bot=self.bot, dispatcher=self.dp, **self.dp.workflow_data)
+        await self.bot.session.close()
+
+    async def run(self, host: str = '0.0.0.0', port: int = 8080, url: str = None) -> None:
+        stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stopped.set)
+            except NotImplementedError:
+                pass
+        await self.start(host, port, url)
+        try:
+            await stopped.wait()
+        finally:
+            await self.stop()